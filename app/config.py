@@ -1,8 +1,16 @@
+from enum import Enum, unique
+
 from pydantic import BaseSettings
 
 from app import __version__
 
 
+@unique
+class FetchEngine(str, Enum):
+    threads = "threads"  # a pool of fetch_limit threads with hrequest, a new connection per fetch
+    asyncio = "asyncio"  # a shared event loop with keep-alive connections pooled per host
+
+
 class AppConfig(BaseSettings):
     app_name: str
     data_dir: str
@@ -11,6 +19,23 @@ class AppConfig(BaseSettings):
     database_url: str
     debug: bool = False
     version: str = __version__
+    fetch_engine: FetchEngine = FetchEngine.threads
+    fetch_limit: int = 100  # how many fetches can be in flight at once, Bot.worker_limit is applied on top of it
+    fetch_limit_per_host: int = 10  # asyncio engine: how many connections can be opened to one host
+    write_flush_size: int = 500  # fetch results are written to the database in batches of this size
+    write_flush_interval: float = 1.0  # or at least every N seconds
+    write_limit: int = 20_000  # how many unflushed writes can be kept in memory
+    lease_margin: int = 30  # a worker lease lasts Bot.timeout + write_flush_interval + lease_margin seconds
+    worker_sync_interval: int = 30  # how often workers started by other processes are picked up
+    data_compaction_interval: int = 3600  # how often Bot.data_retention and Bot.downsample_after are applied
+    bot_sync_interval: int = 5  # how often the Bot settings version is checked for updates by other processes
+    stats_cache_ttl: int = 10  # in seconds, /api/system stats are served from a cache for this long
+    ui_cache_ttl: int = 10  # in seconds, the header and footer info of the ui pages is cached for this long
+    log_queue: bool = True  # log calls only enqueue records, a single thread formats and writes them
+    log_json: bool = False  # write the log as json lines
+    telegram_queue_limit: int = 1000  # how many telegram messages can wait to be sent, new ones are dropped over it
+    telegram_send_interval: float = 3.0  # in seconds between messages, a channel takes about 20 messages a minute
+    tracemalloc_snapshot_limit: int = 10  # how many named tracemalloc snapshots are kept, the oldest is dropped
 
     tags_metadata = [
         {"name": "workers"},
@@ -0,0 +1,67 @@
+from typing import Generic, List, Optional, Type, TypeVar
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection, AsyncIOMotorDatabase
+from pymongo.uri_parser import parse_uri
+
+from app.core.models import Bot, Data, Worker
+
+T = TypeVar("T")
+
+
+def _sort(sort: str) -> List[tuple]:
+    """ "-created_at,name" -> [("created_at", -1), ("name", 1)], the same notation as in MongoCollection.find"""
+    return [(field[1:], -1) if field.startswith("-") else (field, 1) for field in sort.split(",") if field]
+
+
+def _pk(pk):
+    return ObjectId(pk) if isinstance(pk, str) and ObjectId.is_valid(pk) else pk
+
+
+class AsyncCollection(Generic[T]):
+    """Read methods of MongoCollection for the async routes"""
+
+    def __init__(self, model: Type[T], db: "AsyncDB", name: str):
+        self.model = model
+        self.db = db
+        self.name = name
+
+    @property
+    def collection(self) -> AsyncIOMotorCollection:
+        return self.db.database[self.name]
+
+    async def find(self, query: dict, sort: str = "", limit: int = 0, projection: Optional[dict] = None) -> List[T]:
+        cursor = self.collection.find(query, projection, limit=limit)
+        if sort:
+            cursor = cursor.sort(_sort(sort))
+        return [self.model(**doc) async for doc in cursor]  # type:ignore
+
+    async def get_or_none(self, pk) -> Optional[T]:
+        doc = await self.collection.find_one({"_id": _pk(pk)})
+        return self.model(**doc) if doc else None  # type:ignore
+
+    async def count(self, query: dict) -> int:
+        return await self.collection.count_documents(query)
+
+
+class AsyncDB:
+    """A motor counterpart of DB for the read-only routes. Writes stay on DB.
+    The client is created on the first call, inside the event loop of the server."""
+
+    def __init__(self, db_url: str):
+        self.db_url = db_url
+        self.database_name = parse_uri(db_url)["database"]
+        self._client: Optional[AsyncIOMotorClient] = None
+        self.bot: AsyncCollection[Bot] = AsyncCollection(Bot, self, "bot")
+        self.worker: AsyncCollection[Worker] = AsyncCollection(Worker, self, "worker")
+        self.data: AsyncCollection[Data] = AsyncCollection(Data, self, "data")
+
+    @property
+    def database(self) -> AsyncIOMotorDatabase:
+        if self._client is None:
+            self._client = AsyncIOMotorClient(self.db_url)
+        return self._client[self.database_name]
+
+    def close(self):
+        if self._client:
+            self._client.close()
@@ -0,0 +1,65 @@
+import threading
+import time
+from dataclasses import dataclass
+from enum import Enum, unique
+from typing import Dict, Optional
+
+
+@unique
+class CircuitState(str, Enum):
+    closed = "closed"
+    open = "open"
+    half_open = "half_open"  # one probe fetch is let through
+
+
+@dataclass
+class _Circuit:
+    state: CircuitState = CircuitState.closed
+    failures: int = 0  # in a row
+    opened_at: Optional[float] = None
+
+
+class CircuitBreaker:
+    """A circuit per host. It opens after `threshold` failures in a row, and then fetches of the host fail
+    at once. After `cooldown` seconds one probe fetch is let through: a success closes the circuit,
+    a failure opens it again. The settings are passed on every call, so they can be changed at runtime."""
+
+    def __init__(self):
+        self._circuits: Dict[str, _Circuit] = {}
+        self._lock = threading.Lock()
+
+    def allow(self, host: str, threshold: int, cooldown: int) -> bool:
+        if not threshold:
+            return True
+        with self._lock:
+            circuit = self._circuits.get(host)
+            if circuit is None or circuit.state == CircuitState.closed:
+                return True
+            # a probe which is lost without a result doesn't block the host forever: the next one goes after cooldown
+            if time.time() - circuit.opened_at >= cooldown:  # type:ignore
+                circuit.state = CircuitState.half_open
+                circuit.opened_at = time.time()
+                return True
+            return False
+
+    def record(self, host: str, success: bool, threshold: int):
+        with self._lock:
+            circuit = self._circuits.setdefault(host, _Circuit())
+            if success:
+                circuit.state = CircuitState.closed
+                circuit.failures = 0
+                circuit.opened_at = None
+                return
+            circuit.failures += 1
+            if circuit.state == CircuitState.half_open or (threshold and circuit.failures >= threshold):
+                circuit.state = CircuitState.open
+                circuit.opened_at = time.time()
+
+    def get_stats(self) -> Dict[str, dict]:
+        """Hosts with an open circuit or with failures in a row"""
+        with self._lock:
+            return {
+                host: {"state": c.state.value, "failures": c.failures, "opened_at": c.opened_at}
+                for host, c in self._circuits.items()
+                if c.failures
+            }
@@ -1,12 +1,17 @@
 import logging
 import os
-from logging.handlers import RotatingFileHandler
+import queue
+from logging.handlers import QueueListener, RotatingFileHandler
 from pathlib import Path
+from typing import Optional
 
 from mb_commons import Scheduler
 
 from app.config import AppConfig
+from app.core.async_db import AsyncDB
 from app.core.db import DB
+from app.core.logs import RecordQueueHandler, make_formatter
+from app.core.services.data_service import DataService
 from app.core.services.system_service import SystemService
 from app.core.services.worker_service import WorkerService
 
@@ -15,18 +20,24 @@ class Core:
     def __init__(self, config: AppConfig):
         self.config = config
         self.log = logging.getLogger("app")
+        self.log_listener: Optional[QueueListener] = None
         self.init_logger()
 
         self.db: DB = DB(config.database_url)
+        self.async_db: AsyncDB = AsyncDB(config.database_url)
         self.system_service: SystemService = SystemService(config, self.log, self.db)
         self.worker_service: WorkerService = WorkerService(config, self.log, self.db, self.system_service)
+        self.data_service: DataService = DataService(config, self.log, self.db, self.async_db, self.system_service)
         self.scheduler = self.init_scheduler()
         self.startup()
         self.log.info("app started")
 
     def init_scheduler(self) -> Scheduler:
+        self.worker_service.start()
         scheduler = Scheduler(self.log)
-        scheduler.add_job(self.worker_service.process_workers, 2)
+        scheduler.add_job(self.system_service.sync_bot, self.config.bot_sync_interval)
+        scheduler.add_job(self.worker_service.sync_workers, self.config.worker_sync_interval)
+        scheduler.add_job(self.data_service.compact, self.config.data_compaction_interval)
 
         scheduler.start()
         self.log.debug("scheduler started")
@@ -38,24 +49,38 @@ class Core:
         self.log.setLevel(logging.DEBUG if self.config.debug else logging.INFO)
         self.log.propagate = False
 
-        fmt = logging.Formatter(fmt="%(asctime)s - %(name)s - %(levelname)s - %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+        fmt = make_formatter(self.config.log_json)
 
         console_handler = logging.StreamHandler()
         console_handler.setLevel(logging.DEBUG)
         console_handler.setFormatter(fmt)
-        self.log.addHandler(console_handler)
 
         file_handler = RotatingFileHandler(f"{self.config.data_dir}/app.log", maxBytes=10 * 1024 * 1024, backupCount=1)
         file_handler.setLevel(logging.INFO)
         file_handler.setFormatter(fmt)
-        self.log.addHandler(file_handler)
+
+        if self.config.log_queue:
+            # a log call only puts the record into the queue, one thread does the formatting and the disk io
+            log_queue: queue.SimpleQueue = queue.SimpleQueue()
+            self.log.addHandler(RecordQueueHandler(log_queue))
+            self.log_listener = QueueListener(log_queue, console_handler, file_handler, respect_handler_level=True)
+            self.log_listener.start()
+        else:
+            self.log.addHandler(console_handler)
+            self.log.addHandler(file_handler)
 
     def startup(self):
         pass
 
     def shutdown(self):
         self.scheduler.stop()
+        self.worker_service.close()
+        self.system_service.telegram_sender.stop()
+        self.system_service.memory_snapshots.stop_auto()
+        self.async_db.close()
         self.db.close()
         self.log.info("app stopped")
+        if self.log_listener:
+            self.log_listener.stop()  # it writes out the queued records
         # noinspection PyUnresolvedReferences,PyProtectedMember
         os._exit(0)
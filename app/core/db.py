@@ -1,11 +1,13 @@
 from mb_commons.mongo import MongoCollection, MongoConnection
 from pymongo import IndexModel
 
+from app.core.metrics import register_db_listener
 from app.core.models import Bot, Data, Worker
 
 
 class DB:
     def __init__(self, db_url: str):
+        register_db_listener()
         conn = MongoConnection.connect(db_url)
         self._client = conn.client
         self._database = conn.database
@@ -24,6 +26,11 @@ class DB:
                 IndexModel("worker"),
                 IndexModel("status"),
                 IndexModel("created_at"),
+                IndexModel([("created_at", -1), ("_id", -1)]),
+                IndexModel([("worker", 1), ("created_at", -1), ("_id", -1)]),
+                IndexModel([("duration", -1)]),
+                IndexModel([("first_byte_duration", -1)]),
+                IndexModel([("size", -1)]),
             ],
         )
 
@@ -31,7 +38,14 @@ class DB:
         self._client.close()
 
     def get_stats(self):
+        """Counts and sizes from the collection metadata, it doesn't scan the documents"""
         db_stats = {}
         for col in self._database.list_collection_names():
-            db_stats[col] = self._database[col].count_documents({})
+            stats = self._database.command("collStats", col)
+            db_stats[col] = {
+                "count": stats["count"],
+                "size": stats["size"],
+                "storage_size": stats["storageSize"],
+                "index_size": stats["totalIndexSize"],
+            }
         return db_stats
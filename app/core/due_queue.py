@@ -0,0 +1,83 @@
+import heapq
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+class DueQueue:
+    """A min-heap of worker deadlines (unix timestamps) keyed by worker id.
+
+    A worker has one live deadline. Rescheduling or removing a worker leaves a stale heap entry behind,
+    it's skipped on pop. A popped worker stays known to the queue as "in flight" until it's rescheduled,
+    so reschedule() after a fetch is a no-op for a worker which was removed while it was working."""
+
+    def __init__(self):
+        self._heap: List[Tuple[float, str]] = []
+        self._due: Dict[str, Optional[float]] = {}  # None means in flight
+        self._cond = threading.Condition()
+
+    def push(self, pk: str, due_at: float):
+        with self._cond:
+            self._due[pk] = due_at
+            heapq.heappush(self._heap, (due_at, pk))
+            self._cond.notify_all()
+
+    def reschedule(self, pk: str, due_at: float):
+        with self._cond:
+            if pk in self._due:
+                self.push(pk, due_at)
+
+    def remove(self, pk: str):
+        with self._cond:
+            self._due.pop(pk, None)
+            self._cond.notify_all()
+
+    def pop_due(self, limit: int, now: Optional[float] = None) -> List[Tuple[str, float]]:
+        """Pop up to `limit` overdue workers, returns (pk, due_at) pairs"""
+        now = time.time() if now is None else now
+        result: List[Tuple[str, float]] = []
+        with self._cond:
+            self._drop_stale()
+            while self._heap and len(result) < limit and self._heap[0][0] <= now:
+                due_at, pk = heapq.heappop(self._heap)
+                self._due[pk] = None
+                result.append((pk, due_at))
+                self._drop_stale()
+        return result
+
+    def count_due(self, now: Optional[float] = None) -> int:
+        now = time.time() if now is None else now
+        with self._cond:
+            return sum(1 for due_at in self._due.values() if due_at is not None and due_at <= now)
+
+    def next_due(self) -> Optional[float]:
+        with self._cond:
+            self._drop_stale()
+            return self._heap[0][0] if self._heap else None
+
+    def wait(self, timeout: Optional[float] = None):
+        """Sleep until the nearest deadline, a change of the queue or the timeout, whichever comes first"""
+        with self._cond:
+            next_due = self.next_due()
+            delay = timeout
+            if next_due is not None:
+                until_due = max(next_due - time.time(), 0)
+                delay = until_due if timeout is None else min(until_due, timeout)
+            if delay is None or delay > 0:
+                self._cond.wait(delay)
+
+    def notify(self):
+        with self._cond:
+            self._cond.notify_all()
+
+    def __len__(self):
+        with self._cond:
+            return sum(1 for due_at in self._due.values() if due_at is not None)
+
+    def __contains__(self, pk: str) -> bool:
+        with self._cond:
+            return pk in self._due
+
+    def _drop_stale(self):
+        while self._heap and self._due.get(self._heap[0][1], -1) != self._heap[0][0]:
+            heapq.heappop(self._heap)
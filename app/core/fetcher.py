@@ -0,0 +1,257 @@
+import asyncio
+import json
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+from mb_commons import hrequest
+
+NOT_MODIFIED = 304
+TOO_LARGE = "too_large"
+CHUNK_SIZE = 64 * 1024
+
+
+@dataclass
+class FetchResponse:
+    http_code: int = 0
+    body: str = ""
+    headers: Dict[str, str] = field(default_factory=dict)
+    error: Optional[str] = None
+    json: Any = None
+    json_parse_error: bool = False
+    size: int = 0  # body size, in bytes
+    # in seconds; dns, connect and first_byte durations are measured by the asyncio engine only
+    duration: float = 0
+    dns_duration: Optional[float] = None
+    connect_duration: Optional[float] = None
+    first_byte_duration: Optional[float] = None
+    parse_duration: float = 0
+
+    def is_error(self) -> bool:
+        return self.error is not None
+
+    def is_timeout_error(self) -> bool:
+        return self.error == "timeout"
+
+    def is_too_large(self) -> bool:
+        return self.error == TOO_LARGE
+
+    def is_not_modified(self) -> bool:
+        return self.http_code == NOT_MODIFIED
+
+    def get_header(self, name: str) -> Optional[str]:
+        name = name.lower()
+        return next((value for key, value in self.headers.items() if key.lower() == name), None)
+
+    def parse_json(self):
+        started_at = time.perf_counter()
+        try:
+            self.json = json.loads(self.body)
+        except ValueError:
+            self.json_parse_error = True
+        self.parse_duration = time.perf_counter() - started_at
+
+
+def _content_length(headers) -> int:
+    try:
+        return int(headers.get("Content-Length") or 0)
+    except ValueError:
+        return 0
+
+
+def _decode(raw: bytes, charset: Optional[str]) -> str:
+    return raw.decode(charset or "utf-8", errors="replace")
+
+
+def _stream_fetch(url: str, timeout: int, headers: Optional[Dict[str, str]], max_size: int) -> FetchResponse:
+    """Blocking fetch which reads the body in chunks and stops as soon as it's larger than max_size"""
+    started_at = time.perf_counter()
+    try:
+        try:
+            resp = urllib.request.urlopen(urllib.request.Request(url, headers=headers or {}), timeout=timeout)  # nosec
+        except urllib.error.HTTPError as e:
+            resp = e  # 304 and error codes come as an exception, it's a response all the same
+        with resp:
+            res = FetchResponse(http_code=resp.status, headers=dict(resp.headers))
+            if _content_length(resp.headers) > max_size:
+                res.error, res.size = TOO_LARGE, _content_length(resp.headers)
+            else:
+                chunks = []
+                while chunk := resp.read(CHUNK_SIZE):
+                    res.size += len(chunk)
+                    if res.size > max_size:
+                        res.error = TOO_LARGE
+                        break
+                    if time.perf_counter() - started_at > timeout:
+                        raise socket.timeout()
+                    chunks.append(chunk)
+                if not res.is_error():
+                    res.body = _decode(b"".join(chunks), resp.headers.get_content_charset())
+    except socket.timeout:
+        res = FetchResponse(error="timeout")
+    except urllib.error.URLError as e:
+        res = FetchResponse(error="timeout" if isinstance(e.reason, socket.timeout) else f"URLError: {e.reason}")
+    except Exception as e:
+        res = FetchResponse(error=f"{type(e).__name__}: {str(e)}")
+    res.duration = time.perf_counter() - started_at
+    if not res.is_error() and not res.is_not_modified():
+        res.parse_json()
+    return res
+
+
+def thread_fetch(
+    url: str,
+    timeout: int,
+    headers: Optional[Dict[str, str]] = None,
+    max_size: int = 0,
+) -> FetchResponse:
+    """Blocking fetch via hrequest, a fresh connection per call. With max_size the body is streamed instead,
+    hrequest reads it into memory whatever the size is."""
+    if max_size:
+        return _stream_fetch(url, timeout, headers, max_size)
+    started_at = time.perf_counter()
+    r = hrequest(url, timeout=timeout, headers=headers)
+    duration = time.perf_counter() - started_at
+    if r.is_timeout_error():
+        return FetchResponse(error="timeout", duration=duration)
+    if r.is_error():
+        return FetchResponse(http_code=r.http_code, error=r.error, duration=duration)
+    size = len(r.body.encode())
+    res = FetchResponse(http_code=r.http_code, body=r.body, headers=r.headers, size=size, duration=duration)
+    if not res.is_not_modified():
+        started_at = time.perf_counter()
+        res.json_parse_error = r.json_parse_error  # hrequest parses the body on the first access
+        res.json = None if res.json_parse_error else r.json
+        res.parse_duration = time.perf_counter() - started_at
+    return res
+
+
+def _trace_config() -> aiohttp.TraceConfig:
+    """Marks the request phases in trace_request_ctx, a dict passed to every request"""
+
+    def mark(name: str):
+        async def callback(_session, ctx, _params):
+            ctx.trace_request_ctx[name] = time.perf_counter()
+
+        return callback
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_dns_resolvehost_start.append(mark("dns_start"))
+    trace_config.on_dns_resolvehost_end.append(mark("dns_end"))
+    trace_config.on_connection_create_start.append(mark("connect_start"))
+    trace_config.on_connection_create_end.append(mark("connect_end"))
+    trace_config.on_request_end.append(mark("first_byte"))  # the response headers are received
+    return trace_config
+
+
+def _apply_timings(res: FetchResponse, started_at: float, marks: Dict[str, float]):
+    res.duration = time.perf_counter() - started_at
+    dns_duration = 0.0
+    if "dns_start" in marks and "dns_end" in marks:
+        dns_duration = res.dns_duration = marks["dns_end"] - marks["dns_start"]
+    if "connect_start" in marks and "connect_end" in marks:
+        # a connection is created with the dns lookup inside; a reused keep-alive connection has no marks at all
+        res.connect_duration = marks["connect_end"] - marks["connect_start"] - dns_duration
+    if "first_byte" in marks:
+        res.first_byte_duration = marks["first_byte"] - started_at
+
+
+class AsyncFetcher:
+    """Runs fetches on a dedicated event loop thread. Connections are kept alive and pooled per host,
+    `limit` caps how many fetches can be in flight at once."""
+
+    def __init__(self, limit: int, limit_per_host: int):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.loop = asyncio.new_event_loop()
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._thread = threading.Thread(target=self._run_loop, name="async_fetcher", daemon=True)
+        self._thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # the session and the semaphore must be created inside the loop thread
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host)
+            self._session = aiohttp.ClientSession(connector=connector, trace_configs=[_trace_config()])
+            self._semaphore = asyncio.Semaphore(self.limit)
+        return self._session
+
+    @staticmethod
+    async def _read(resp: aiohttp.ClientResponse, res: FetchResponse, max_size: int):
+        """Read the body in chunks, a body larger than max_size is dropped as soon as it's over the limit"""
+        if max_size and _content_length(resp.headers) > max_size:
+            res.error, res.size = TOO_LARGE, _content_length(resp.headers)
+            return
+        chunks = []
+        async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+            res.size += len(chunk)
+            if max_size and res.size > max_size:
+                res.error = TOO_LARGE
+                return
+            chunks.append(chunk)
+        res.body = _decode(b"".join(chunks), resp.charset)
+
+    async def fetch_async(
+        self,
+        url: str,
+        timeout: int,
+        headers: Optional[Dict[str, str]] = None,
+        max_size: int = 0,
+    ) -> FetchResponse:
+        session = self._get_session()
+        async with self._semaphore:  # type:ignore
+            started_at = time.perf_counter()
+            marks: Dict[str, float] = {}
+            try:
+                client_timeout = aiohttp.ClientTimeout(total=timeout)
+                async with session.get(url, headers=headers, timeout=client_timeout, trace_request_ctx=marks) as resp:
+                    res = FetchResponse(http_code=resp.status, headers=dict(resp.headers))
+                    await self._read(resp, res, max_size)
+            except asyncio.TimeoutError:
+                res = FetchResponse(error="timeout")
+            except Exception as e:
+                res = FetchResponse(error=f"{type(e).__name__}: {str(e)}")
+            _apply_timings(res, started_at, marks)
+            if res.is_error() or res.is_not_modified():
+                return res
+        await self.loop.run_in_executor(None, res.parse_json)  # a large body would stall every fetch of the loop
+        return res
+
+    async def _fetch_many(self, urls: List[str], timeout: int) -> List[FetchResponse]:
+        return await asyncio.gather(*[self.fetch_async(url, timeout) for url in urls])
+
+    def submit(self, url: str, timeout: int, headers: Optional[Dict[str, str]] = None, max_size: int = 0) -> Future:
+        return asyncio.run_coroutine_threadsafe(self.fetch_async(url, timeout, headers, max_size), self.loop)
+
+    def fetch(
+        self,
+        url: str,
+        timeout: int,
+        headers: Optional[Dict[str, str]] = None,
+        max_size: int = 0,
+    ) -> FetchResponse:
+        return self.submit(url, timeout, headers, max_size).result()
+
+    def fetch_many(self, urls: List[str], timeout: int) -> List[FetchResponse]:
+        return asyncio.run_coroutine_threadsafe(self._fetch_many(urls, timeout), self.loop).result()
+
+    async def _close_session(self):
+        if self._session:
+            await self._session.close()
+        await self.loop.shutdown_default_executor()
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self._close_session(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
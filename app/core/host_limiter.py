@@ -0,0 +1,66 @@
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+SLOT_WAIT = 5.0  # in seconds, a worker waiting for a busy host is retried after it unless release() wakes it first
+
+
+@dataclass
+class _Host:
+    tokens: float
+    updated_at: float
+    in_flight: int = 0
+    waiters: Dict[str, None] = field(default_factory=dict)  # an ordered set of the workers waiting for a slot
+
+
+class HostLimiter:
+    """A token bucket and a concurrency cap per host, shared by all the workers of the host.
+    `rps` and `concurrency` are read on every call, so they can be changed at runtime; 0 turns a limit off.
+    A worker turned away by the concurrency cap is kept as a waiter of the host and release() returns the first
+    one to be woken up, so the workers of a busy host aren't polled."""
+
+    def __init__(self):
+        self._hosts: Dict[str, _Host] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, host: str, rps: float, concurrency: int, waiter: Optional[str] = None) -> float:
+        """Take a request slot of the host. It returns 0 on success or how many seconds to wait before the next try.
+        If the host is at its concurrency cap, the waiter is queued to be returned by release()."""
+        now = time.monotonic()
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is None:
+                state = self._hosts[host] = _Host(tokens=max(rps, 1), updated_at=now)
+            if concurrency and state.in_flight >= concurrency:
+                if waiter:
+                    state.waiters[waiter] = None
+                return SLOT_WAIT
+            if waiter:
+                state.waiters.pop(waiter, None)
+            if rps:
+                state.tokens = min(state.tokens + (now - state.updated_at) * rps, max(rps, 1))
+                state.updated_at = now
+                if state.tokens < 1:
+                    return (1 - state.tokens) / rps
+                state.tokens -= 1
+            state.in_flight += 1
+            return 0
+
+    def release(self, host: str) -> Optional[str]:
+        """Free a slot of the host, it returns the first waiter for it if there is one"""
+        with self._lock:
+            state = self._hosts.get(host)
+            if not state:
+                return None
+            if state.in_flight > 0:
+                state.in_flight -= 1
+            if state.waiters:
+                waiter = next(iter(state.waiters))
+                del state.waiters[waiter]
+                return waiter
+            return None
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {host: state.in_flight for host, state in self._hosts.items() if state.in_flight}
@@ -0,0 +1,43 @@
+from typing import Any, Dict, List
+
+_MISSING = object()
+
+
+def _make_tree(paths: List[str]) -> Dict[str, dict]:
+    """Nested dicts of the path keys, an empty dict keeps the whole value"""
+    tree: Dict[str, dict] = {}
+    for path in sorted(paths, key=lambda p: p.count(".")):  # a parent path goes first and wins over its children
+        node = tree
+        *parents, last = path.split(".")
+        for key in parents:
+            if key in node and not node[key]:
+                break
+            node = node.setdefault(key, {})
+        else:
+            node[last] = {}
+    return tree
+
+
+def _project(value: Any, tree: Dict[str, dict]) -> Any:
+    if not tree:
+        return value
+    if isinstance(value, list):
+        return [item for item in (_project(v, tree) for v in value) if item is not _MISSING]
+    if isinstance(value, dict):
+        result = {}
+        for key, subtree in tree.items():
+            if key in value:
+                item = _project(value[key], subtree)
+                if item is not _MISSING:
+                    result[key] = item
+        return result
+    return _MISSING  # a scalar has no fields
+
+
+def pick(value: Any, paths: List[str]) -> Any:
+    """Keep only the given dotted paths of a json value, e.g. ["price", "items.id"].
+    A path goes through lists: "items.id" keeps the id of every item. Missing paths are skipped."""
+    if not paths:
+        return value
+    result = _project(value, _make_tree(paths))
+    return None if result is _MISSING else result
@@ -0,0 +1,118 @@
+import asyncio
+import codecs
+import os
+from typing import AsyncIterator, Awaitable, Callable, Iterator, List, Optional
+
+CHUNK_SIZE = 64 * 1024
+
+
+def make_filter(level: Optional[str] = None, contains: Optional[str] = None) -> Optional[Callable[[str], bool]]:
+    """A line filter for the app log formats: "time - name - LEVEL - message" or a json line"""
+    if not level and not contains:
+        return None
+    level_marks = [f" - {level.upper()} - ", f'"level": "{level.upper()}"'] if level else [""]
+
+    def match(line: str) -> bool:
+        return any(mark in line for mark in level_marks) and (not contains or contains in line)
+
+    return match
+
+
+def tail(path: str, lines: int, line_filter: Optional[Callable[[str], bool]] = None) -> List[str]:
+    """The last N lines (matching the filter), the file is read backwards in chunks until there are enough of them"""
+    result: List[str] = []
+    with open(path, "rb") as f:
+        position = f.seek(0, os.SEEK_END)
+        rest = b""  # the beginning of a line which started in the previous chunk
+        while position > 0 and len(result) < lines:
+            size = min(CHUNK_SIZE, position)
+            position -= size
+            f.seek(position)
+            chunk = f.read(size) + rest
+            parts = chunk.split(b"\n")
+            rest = parts.pop(0)  # it can be incomplete, unless the file start is reached
+            for part in reversed(parts):
+                _add_line(result, part, line_filter)
+        if position == 0 and len(result) < lines:
+            _add_line(result, rest, line_filter)
+    return list(reversed(result[:lines]))
+
+
+def _add_line(result: List[str], raw: bytes, line_filter: Optional[Callable[[str], bool]]):
+    if not raw:
+        return
+    line = raw.decode("utf-8", errors="replace") + "\n"
+    if line_filter is None or line_filter(line):
+        result.append(line)
+
+
+def read_range(
+    path: str,
+    offset: int = 0,
+    length: Optional[int] = None,
+    line_filter: Optional[Callable[[str], bool]] = None,
+) -> Iterator[str]:
+    """Stream the file from the byte offset, line by line if there is a filter or in chunks otherwise"""
+    with open(path, "rb") as f:
+        f.seek(offset)
+        left = length if length is not None else float("inf")
+        if line_filter is None:
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")  # a chunk can end inside a character
+            while left > 0:
+                chunk = f.read(int(min(CHUNK_SIZE, left)))
+                if not chunk:
+                    break
+                left -= len(chunk)
+                yield decoder.decode(chunk)
+            yield decoder.decode(b"", final=True)
+            return
+        for raw in f:
+            left -= len(raw)
+            line = raw.decode("utf-8", errors="replace")
+            if line_filter(line):
+                yield line
+            if left <= 0:
+                break
+
+
+def follow(
+    path: str,
+    line_filter: Optional[Callable[[str], bool]] = None,
+    poll_interval: float = 1.0,
+    is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+) -> AsyncIterator[str]:
+    """New lines as they are written to the end of the file. A rotated or cleaned file is read from its start.
+    The current end of the file is taken at the call, not at the first iteration.
+    It ends when is_disconnected() is true, the client of a stream is checked on every poll."""
+    return _follow(path, os.path.getsize(path), line_filter, poll_interval, is_disconnected)
+
+
+async def _follow(
+    path: str,
+    position: int,
+    line_filter: Optional[Callable[[str], bool]],
+    poll_interval: float,
+    is_disconnected: Optional[Callable[[], Awaitable[bool]]],
+) -> AsyncIterator[str]:
+    rest = ""
+    while True:
+        await asyncio.sleep(poll_interval)
+        if is_disconnected and await is_disconnected():
+            return
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            continue
+        if size < position:
+            position, rest = 0, ""
+        if size == position:
+            continue
+        with open(path, "rb") as f:
+            f.seek(position)
+            data = f.read(size - position)
+        position += len(data)
+        lines = (rest + data.decode("utf-8", errors="replace")).split("\n")
+        rest = lines.pop()
+        for line in lines:
+            if line_filter is None or line_filter(line):
+                yield line
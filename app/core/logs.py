@@ -0,0 +1,45 @@
+import copy
+import json
+import logging
+from logging.handlers import QueueHandler
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class JsonFormatter(logging.Formatter):
+    """One json object per line: time, logger, level, message and the traceback if there is one"""
+
+    def __init__(self):
+        super().__init__(datefmt=DATE_FORMAT)
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record, self.datefmt),
+            "logger": record.name,
+            "level": record.levelname,
+            "message": record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def make_formatter(json_format: bool) -> logging.Formatter:
+    return JsonFormatter() if json_format else logging.Formatter(fmt=TEXT_FORMAT, datefmt=DATE_FORMAT)
+
+
+class RecordQueueHandler(QueueHandler):
+    """It only merges the message args and enqueues the record, the formatting is left to the writer thread.
+    A traceback is rendered here, while the exception is still alive, and kept apart from the message."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
@@ -0,0 +1,109 @@
+import os
+import threading
+import tracemalloc
+from collections import OrderedDict
+from datetime import datetime
+from logging import Logger
+from typing import List, Optional, Tuple
+
+from mb_commons import utc_now
+
+from app.core.errors import UserError
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+AUTO_PREFIX = "auto-"
+
+
+class SnapshotStore:
+    """Named tracemalloc snapshots, the oldest one is dropped over the limit. With own_only a snapshot keeps only
+    the allocations with a frame of the app in their traceback, so one needs tracemalloc.start(nframe > 1)
+    to see the allocations done by the libraries on behalf of the app.
+    The auto snapshots are kept in a ring of their own, so they never push out a baseline taken by hand."""
+
+    def __init__(self, limit: int, log: Logger):
+        self.limit = limit
+        self.log = log
+        self._snapshots: "OrderedDict[str, Tuple[datetime, tracemalloc.Snapshot]]" = OrderedDict()
+        self._auto_snapshots: "OrderedDict[str, Tuple[datetime, tracemalloc.Snapshot]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._auto_stop: Optional[threading.Event] = None
+
+    def take(self, name: Optional[str] = None, own_only: bool = True) -> dict:
+        if not tracemalloc.is_tracing():
+            raise UserError("tracemalloc is not started")
+        taken_at = utc_now()
+        name = name or taken_at.strftime("%Y%m%d-%H%M%S")
+        snapshot = tracemalloc.take_snapshot()
+        if own_only:
+            snapshot = snapshot.filter_traces([tracemalloc.Filter(True, f"{APP_DIR}{os.sep}*", all_frames=True)])
+        with self._lock:
+            snapshots = self._auto_snapshots if name.startswith(AUTO_PREFIX) else self._snapshots
+            self._remove(name)
+            snapshots[name] = (taken_at, snapshot)
+            while len(snapshots) > self.limit:
+                snapshots.popitem(last=False)
+        return self._info(name, taken_at, snapshot)
+
+    def list(self) -> List[dict]:
+        with self._lock:
+            items = [*self._snapshots.items(), *self._auto_snapshots.items()]
+            return [self._info(name, taken_at, snapshot) for name, (taken_at, snapshot) in items]
+
+    def delete(self, name: str):
+        with self._lock:
+            self._remove(name)
+
+    def top(self, name: str, key_type: str = "lineno", limit: int = 30) -> str:
+        stats = self._get(name).statistics(key_type)[:limit]
+        return "".join(self._format(stat, key_type) for stat in stats)
+
+    def compare(self, old: str, new: str, key_type: str = "lineno", limit: int = 30) -> str:
+        """The allocations which grew the most between the snapshots"""
+        stats = self._get(new).compare_to(self._get(old), key_type)[:limit]
+        return "".join(self._format(stat, key_type) for stat in stats)
+
+    def start_auto(self, interval: float):
+        """Take a snapshot every `interval` seconds, the names start with "auto-" """
+        self.stop_auto()
+        self._auto_stop = stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                self.take_auto()
+
+        threading.Thread(target=run, name="tracemalloc_auto", daemon=True).start()
+
+    def take_auto(self):
+        if not tracemalloc.is_tracing():
+            return
+        try:
+            self.take(AUTO_PREFIX + utc_now().strftime("%Y%m%d-%H%M%S"))
+        except Exception as e:  # tracemalloc can be stopped between the check and the snapshot
+            self.log.error(f"tracemalloc auto snapshot: {str(e)}")
+
+    def stop_auto(self):
+        if self._auto_stop:
+            self._auto_stop.set()
+            self._auto_stop = None
+
+    def _remove(self, name: str):
+        self._snapshots.pop(name, None)
+        self._auto_snapshots.pop(name, None)
+
+    def _get(self, name: str) -> tracemalloc.Snapshot:
+        with self._lock:
+            item = self._snapshots.get(name) or self._auto_snapshots.get(name)
+            if not item:
+                raise UserError(f"snapshot '{name}' not found")
+            return item[1]
+
+    @staticmethod
+    def _info(name: str, taken_at: datetime, snapshot: tracemalloc.Snapshot) -> dict:
+        size = sum(trace.size for trace in snapshot.traces)
+        return {"name": name, "taken_at": taken_at, "size": size, "traceback_limit": snapshot.traceback_limit}
+
+    @staticmethod
+    def _format(stat, key_type: str) -> str:
+        if key_type == "traceback":
+            return str(stat) + "\n" + "\n".join(stat.traceback.format()) + "\n\n"
+        return str(stat) + "\n"
@@ -0,0 +1,75 @@
+import threading
+from typing import Dict, Tuple
+
+from prometheus_client import Gauge, Histogram
+from pymongo import monitoring
+
+FETCH_DURATION = Histogram(
+    "fetch_duration_seconds",
+    "Fetch time of the worker sources by the data status and the source host",
+    ["status", "host"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+SCHEDULER_TICK_DURATION = Histogram(
+    "scheduler_tick_seconds",
+    "Time of process_workers: popping due workers, claiming them and dispatching their fetches",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5),
+)
+SCHEDULER_DISPATCHED = Histogram(
+    "scheduler_tick_workers",
+    "Workers dispatched by one process_workers call",
+    buckets=(0, 1, 5, 10, 50, 100, 500),
+)
+DUE_WORKERS = Gauge("scheduler_due_workers", "Workers past their deadline and not dispatched yet")
+IN_FLIGHT_WORKERS = Gauge("scheduler_in_flight_workers", "Workers dispatched and not finished yet")
+DB_DURATION = Histogram(
+    "db_operation_seconds",
+    "Mongo command time by the collection and the command",
+    ["collection", "command"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1, 5),
+)
+HTTP_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request time by the route",
+    ["method", "route", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 10),
+)
+
+
+class DbCommandListener(monitoring.CommandListener):
+    """Times every command of every mongo client, the sync and the async ones, including the bulk writes"""
+
+    def __init__(self):
+        self._started: Dict[Tuple[tuple, int], str] = {}  # (connection address, request id) -> collection
+        self._lock = threading.Lock()
+
+    def started(self, event: monitoring.CommandStartedEvent):
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):  # a command without a collection: ping, isMaster, getMore ...
+            collection = event.command.get("collection", "")
+        with self._lock:
+            self._started[(event.connection_id, event.request_id)] = collection
+
+    def _finished(self, event):
+        with self._lock:
+            collection = self._started.pop((event.connection_id, event.request_id), "")
+        DB_DURATION.labels(collection, event.command_name).observe(event.duration_micros / 1_000_000)
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        self._finished(event)
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        self._finished(event)
+
+
+_listener_lock = threading.Lock()
+_listener_registered = False
+
+
+def register_db_listener():
+    """It must be called before the mongo clients are created, pymongo registers listeners globally"""
+    global _listener_registered
+    with _listener_lock:
+        if not _listener_registered:
+            monitoring.register(DbCommandListener())
+            _listener_registered = True
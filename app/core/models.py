@@ -1,15 +1,36 @@
 from datetime import datetime
 from enum import Enum, unique
-from typing import Any, List, Optional
+from typing import Any, Dict, List, Optional
 
 from mb_commons import utc_now
 from mb_commons.mongo import MongoModel, ObjectIdStr
-from pydantic import BaseModel, Field, HttpUrl
+from pydantic import BaseModel, Field, HttpUrl, PositiveInt
+
+
+# Data status
+@unique
+class DataStatus(str, Enum):
+    ok = "ok"
+    timeout = "timeout"
+    proxy_error = "proxy_error"
+    json_error = "json_error"
+    error = "error"
+    unchanged = "unchanged"  # the same payload as the previous ok one, it's not stored again
+    circuit_open = "circuit_open"  # not fetched, the circuit breaker of the source host is open
+    too_large = "too_large"  # the response is larger than the max size, it was dropped while reading
+
+
+@unique
+class DedupMode(str, Enum):
+    off = "off"
+    record = "record"  # an unchanged payload is stored as a small data record with the unchanged status
+    counter = "counter"  # an unchanged payload bumps Data.repeats of the previous record
 
 
 # Bot
 class Bot(MongoModel):
     id: Optional[int] = Field(None, alias="_id")
+    version: int = 0  # it's incremented on every update, other processes reload the settings when it changes
     timeout: int = 10  # in seconds
     worker_limit: int = 15  # how many workers can work at once
     bot_started: bool = False
@@ -18,6 +39,24 @@ class Bot(MongoModel):
     telegram_channel: bool = False  # system_service.send_telegram_message will work
     telegram_channel_id: int = 0
     telegram_admins: List[int] = []
+    data_retention: Dict[str, int] = {}  # data status -> how many days to keep it, a missing status is kept forever
+    downsample_after: int = 0  # in days, older data keeps only the latest sample per worker and hour; 0 is off
+    dedup_mode: DedupMode = DedupMode.off
+    adaptive_polling: bool = False  # failing workers back off exponentially
+    slow_unchanged: bool = False  # in the adaptive mode, workers with an unchanged payload back off too
+    max_backoff: int = 3600  # in seconds
+    host_concurrency: int = 0  # how many fetches of one host can run at once, 0 is no limit
+    host_rps: float = 0  # how many fetches of one host can start per second, 0 is no limit
+    breaker_threshold: int = 0  # the circuit of a host opens after N timeouts or errors in a row, 0 is off
+    breaker_cooldown: int = 60  # in seconds, how long an open circuit waits before a probe fetch
+    max_response_size: int = 0  # in bytes, a larger response body is not read to the end, 0 is no limit
+    # the state of the data compaction job, it's not a setting and it doesn't change the version
+    downsampled_until: Optional[datetime] = None  # older data is downsampled already, the next run starts there
+    compaction_owner: Optional[str] = None  # the process which runs the compaction now
+    compaction_until: Optional[datetime] = None  # another process can run it after that
+
+    class Config:
+        allow_mutation = False  # an instance is a snapshot shared by all the threads, update_bot publishes a new one
 
 
 class BotUpdate(BaseModel):
@@ -28,6 +67,17 @@ class BotUpdate(BaseModel):
     telegram_admins: List[int]
     timeout: int
     worker_limit: int
+    data_retention: Dict[DataStatus, PositiveInt] = {}  # 0 days would delete all the data of the status at once
+    downsample_after: int = Field(0, ge=0)
+    dedup_mode: DedupMode = DedupMode.off
+    adaptive_polling: bool = False
+    slow_unchanged: bool = False
+    max_backoff: int = 3600
+    host_concurrency: int = 0
+    host_rps: float = 0
+    breaker_threshold: int = 0
+    breaker_cooldown: int = 60
+    max_response_size: int = 0
 
 
 # Worker
@@ -38,6 +88,19 @@ class Worker(MongoModel):
     interval: int  # in seconds
     started: bool = False
     last_work_at: Optional[datetime] = None
+    next_work_at: Optional[datetime] = None  # last_work_at + interval, or later if the worker backs off
+    failures: int = 0  # timeouts and errors in a row
+    unchanged_streak: int = 0  # unchanged payloads in a row
+    lease_owner: Optional[str] = None  # the process which claimed the worker for a fetch
+    lease_until: Optional[datetime] = None  # another process can claim the worker after that
+    retention: Dict[str, int] = {}  # data status -> days, it overrides Bot.data_retention
+    content_hash: Optional[str] = None  # of the last stored ok payload
+    last_data_id: Optional[str] = None  # the data record with this payload
+    etag: Optional[str] = None  # validators of the last ok response, they're sent with the next fetch
+    last_modified: Optional[str] = None
+    max_size: Optional[int] = None  # in bytes, it overrides Bot.max_response_size
+    data_count: int = 0  # data records of the worker, kept up to date on insert and on compaction
+    fields: List[str] = []  # dotted paths of the payload to store, e.g. "items.price"; all of it if empty
     created_at: datetime = Field(default_factory=utc_now)
 
 
@@ -45,21 +108,52 @@ class WorkerCreate(BaseModel):
     name: str
     source: HttpUrl
     interval: int
+    retention: Dict[DataStatus, PositiveInt] = {}
+    max_size: Optional[int] = None
+    fields: List[str] = []
 
 
 # Data
-@unique
-class DataStatus(str, Enum):
-    ok = "ok"
-    timeout = "timeout"
-    proxy_error = "proxy_error"
-    json_error = "json_error"
-    error = "error"
-
-
 class Data(MongoModel):
     id: Optional[ObjectIdStr] = Field(None, alias="_id")
     worker: str
     status: DataStatus
     data: Any
+    http_code: Optional[int] = None
+    size: Optional[int] = None  # response body size, in bytes
+    # fetch timings, in seconds
+    duration: Optional[float] = None
+    dns_duration: Optional[float] = None
+    connect_duration: Optional[float] = None
+    first_byte_duration: Optional[float] = None
+    content_hash: Optional[str] = None
+    repeats: int = 0  # how many times the same payload came after this one, the counter dedup mode
+    last_seen_at: Optional[datetime] = None
     created_at: datetime = Field(default_factory=utc_now)
+
+
+@unique
+class DataSortField(str, Enum):
+    duration = "duration"
+    first_byte_duration = "first_byte_duration"
+    size = "size"
+
+
+@unique
+class DataBucket(str, Enum):
+    minute = "minute"
+    hour = "hour"
+    day = "day"
+
+
+@unique
+class ProfileFormat(str, Enum):
+    collapsed = "collapsed"  # folded stacks for flamegraph.pl, inferno or speedscope
+    speedscope = "speedscope"
+
+
+@unique
+class SnapshotKey(str, Enum):
+    filename = "filename"
+    lineno = "lineno"
+    traceback = "traceback"
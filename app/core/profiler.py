@@ -0,0 +1,122 @@
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from app.core.errors import UserError
+
+MAX_SECONDS = 300  # of a profiling run via the api
+MIN_INTERVAL = 0.001  # in seconds, every sample walks the stacks of all the threads
+MAX_RUNNING = 2  # profiling runs at once, via the api and ?profile= together
+Stack = Tuple[str, ...]  # the thread name and the frames, the outermost first
+
+# the innermost python frames of a thread which waits: a lock or a condition, a selector, a blocking queue get
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),  # concurrent.futures, an idle pool thread blocks in SimpleQueue.get right there
+    ("handlers.py", "dequeue"),  # logging.handlers.QueueListener
+}
+
+_running = threading.BoundedSemaphore(MAX_RUNNING)
+
+
+def _frame_name(code) -> str:
+    path = os.path.join(*code.co_filename.split(os.sep)[-2:])
+    return f"{code.co_name} ({path}:{code.co_firstlineno})"
+
+
+def _is_idle(code) -> bool:
+    return (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES
+
+
+def _thread_group(name: str) -> str:
+    """work_12 -> work, so the threads of a pool are merged in one flamegraph"""
+    return re.sub(r"[_-]?\d+$", "", name) or name
+
+
+class Sampler:
+    """A wall-clock sampling profiler of all the threads. Every `interval` seconds it takes the stack of every
+    thread with sys._current_frames(), so the profiled code isn't slowed down by tracing.
+    A waiting thread is sampled as well, its stack ends in the waiting call (Condition.wait, select and so on).
+    With skip_idle the stacks which end in one of IDLE_FRAMES are dropped, so the profile shows the threads
+    which burn CPU; a wait inside a C call made by other code (time.sleep, a socket read) still shows up.
+    At most MAX_RUNNING samplers run at once, start() raises UserError over it."""
+
+    def __init__(self, interval: float = 0.01, skip_idle: bool = False):
+        self.interval = interval
+        self.skip_idle = skip_idle
+        self.samples: Counter[Stack] = Counter()
+        self.sample_count = 0
+        self.started_at = 0.0
+        self.duration = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "Sampler":
+        if not _running.acquire(blocking=False):
+            raise UserError(f"{MAX_RUNNING} profiling runs are in progress already")
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> "Sampler":
+        if self._thread and not self._stop.is_set():
+            self._stop.set()
+            self._thread.join()
+            self.duration = time.perf_counter() - self.started_at
+            _running.release()
+        return self
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: _thread_group(t.name) for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or (self.skip_idle and _is_idle(frame.f_code)):
+                    continue
+                frames: List[str] = []
+                while frame is not None:
+                    frames.append(_frame_name(frame.f_code))
+                    frame = frame.f_back
+                self.samples[(names.get(thread_id, str(thread_id)), *reversed(frames))] += 1
+            self.sample_count += 1
+
+    def to_collapsed(self) -> str:
+        """The folded stacks format of flamegraph.pl, inferno and speedscope: "thread;outer;...;inner count" """
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.samples.most_common())
+
+    def to_speedscope(self) -> dict:
+        """The speedscope file format, a sampled profile per thread group, the weights are in seconds"""
+        frames: List[dict] = []
+        frame_index: Dict[str, int] = {}
+        profiles: Dict[str, dict] = {}
+        for stack, count in self.samples.items():
+            thread, *names = stack
+            indexes = []
+            for name in names:
+                if name not in frame_index:
+                    frame_index[name] = len(frames)
+                    frames.append({"name": name})
+                indexes.append(frame_index[name])
+            profile = profiles.setdefault(
+                thread,
+                {"type": "sampled", "name": thread, "unit": "seconds", "startValue": 0, "samples": [], "weights": []},
+            )
+            profile["samples"].append(indexes)
+            profile["weights"].append(round(count * self.interval, 6))
+        for profile in profiles.values():
+            profile["endValue"] = round(sum(profile["weights"]), 6)
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames},
+            "profiles": list(profiles.values()),
+            "name": f"{self.duration:.1f}s, {self.sample_count} samples",
+            "exporter": "app",
+        }
@@ -0,0 +1,327 @@
+import base64
+import json
+import math
+import os
+import socket
+from collections import Counter
+from datetime import datetime, timedelta
+from logging import Logger
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from bson import ObjectId
+from mb_commons import utc_now
+from mb_commons.mongo import make_query
+from pymongo import ReturnDocument, UpdateOne
+
+from app.config import AppConfig
+from app.core.async_db import AsyncDB
+from app.core.db import DB
+from app.core.errors import UserError
+from app.core.models import Bot, Data, DataBucket, DataSortField, DataStatus
+from app.core.services import BaseService
+from app.core.services.system_service import SystemService
+
+MAX_PAGE_SIZE = 1000
+DELETE_BATCH = 1000  # ids per delete_many of the compaction
+BUCKET_MS = {DataBucket.minute: 60_000, DataBucket.hour: 3_600_000, DataBucket.day: 86_400_000}
+BINS_PER_DECADE = 20  # of the fetch time histogram, a bin is about 12% wide
+
+
+def histogram_percentile(bins: Dict[int, int], p: float) -> Optional[float]:
+    """Nearest-rank percentile of a log-scale histogram: bin -> count, where bin is floor(log10(x) * BINS_PER_DECADE).
+    It returns the geometric middle of the bin with the rank, so the error is within half a bin."""
+    total = sum(bins.values())
+    if not total:
+        return None
+    rank = max(math.ceil(p / 100 * total), 1)
+    seen = 0
+    for value_bin in sorted(bins):
+        seen += bins[value_bin]
+        if seen >= rank:
+            return round(10 ** ((value_bin + 0.5) / BINS_PER_DECADE), 4)
+    return None
+
+
+def encode_cursor(data: Data) -> str:
+    return base64.urlsafe_b64encode(json.dumps([data.created_at.isoformat(), data.id]).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, ObjectId]:
+    try:
+        created_at, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(created_at), ObjectId(pk)
+    except Exception:
+        raise UserError("invalid cursor")
+
+
+class DataService(BaseService):
+    def __init__(self, config: AppConfig, log: Logger, db: DB, async_db: AsyncDB, system_service: SystemService):
+        super().__init__(config, log, db)
+        self.async_db = async_db
+        self.system_service = system_service
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"  # lease owner of the compaction job
+        self._recounted = False
+
+    @staticmethod
+    def _make_query(
+        worker: Optional[str],
+        status: Optional[DataStatus],
+        since: Optional[datetime],
+        until: Optional[datetime],
+    ) -> dict:
+        query = make_query(worker=worker, status=status)
+        if since or until:
+            query["created_at"] = {}
+            if since:
+                query["created_at"]["$gte"] = since
+            if until:
+                query["created_at"]["$lt"] = until
+        return query
+
+    async def find_page_async(
+        self,
+        worker: Optional[str] = None,
+        status: Optional[DataStatus] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        cursor: Optional[str] = None,
+        limit: int = 100,
+    ) -> Tuple[List[Data], Optional[str]]:
+        """Keyset pagination on (created_at, _id), newest first. Returns the page and the cursor of the next page."""
+        query = self._page_query(worker, status, since, until, cursor, limit)
+        items = await self.async_db.data.find(query, "-created_at,-_id", limit)
+        next_cursor = encode_cursor(items[-1]) if len(items) == limit else None
+        return items, next_cursor
+
+    def _page_query(
+        self,
+        worker: Optional[str],
+        status: Optional[DataStatus],
+        since: Optional[datetime],
+        until: Optional[datetime],
+        cursor: Optional[str],
+        limit: int,
+    ) -> dict:
+        if not 0 < limit <= MAX_PAGE_SIZE:  # mongo takes limit 0 as no limit at all
+            raise UserError(f"limit must be from 1 to {MAX_PAGE_SIZE}")
+        query = self._make_query(worker, status, since, until)
+        if cursor:
+            created_at, pk = decode_cursor(cursor)
+            after_cursor = [{"created_at": {"$lt": created_at}}, {"created_at": created_at, "_id": {"$lt": pk}}]
+            query = {"$and": [query, {"$or": after_cursor}]}
+        return query
+
+    def find_top(self, by: DataSortField, since: Optional[datetime] = None, limit: int = 100) -> List[Data]:
+        """The slowest fetches or the largest payloads, it walks the index on the `by` field"""
+        query = self._make_query(None, None, since, None)
+        query[by.value] = {"$ne": None}
+        return [Data(**d) for d in self.db.data.collection.find(query, {"data": 0}).sort(by.value, -1).limit(limit)]
+
+    def find_slowest_workers(self, since: Optional[datetime] = None, limit: int = 20) -> List[dict]:
+        """Workers by the average fetch time since the given time (the last hour by default)"""
+        since = since or utc_now() - timedelta(hours=1)
+        pipeline = [
+            {"$match": {"created_at": {"$gte": since}, "duration": {"$ne": None}}},
+            {
+                "$group": {
+                    "_id": "$worker",
+                    "count": {"$sum": 1},
+                    "avg_duration": {"$avg": "$duration"},
+                    "max_duration": {"$max": "$duration"},
+                    "avg_size": {"$avg": "$size"},
+                    "max_size": {"$max": "$size"},
+                },
+            },
+            {"$sort": {"avg_duration": -1}},
+            {"$limit": limit},
+        ]
+        return [{"worker": row.pop("_id"), **row} for row in self.db.data.collection.aggregate(pipeline)]
+
+    def export(
+        self,
+        worker: Optional[str] = None,
+        status: Optional[DataStatus] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+    ) -> Iterator[str]:
+        """NDJSON lines straight from the cursor, only one batch of documents is kept in memory"""
+        query = self._make_query(worker, status, since, until)
+        docs = self.db.data.collection.find(query, batch_size=1000).sort([("created_at", -1), ("_id", -1)])
+        try:
+            for doc in docs:
+                yield Data(**doc).json(by_alias=True) + "\n"
+        finally:
+            docs.close()
+
+    def get_stats(
+        self,
+        worker: Optional[str] = None,
+        bucket: DataBucket = DataBucket.hour,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+    ) -> List[dict]:
+        """Counts by status, error rate and approximate fetch time percentiles per worker and time bucket.
+        The grouping runs on the database. It sends back a log-scale histogram of the fetch times of a group,
+        not the fetch times themselves, so a reply has at most a few dozen rows per group whatever the data size is."""
+        since = since or utc_now() - timedelta(days=1)
+        bucket_ms = BUCKET_MS[bucket]
+        bucket_start = {"$subtract": ["$created_at", {"$mod": [{"$toLong": "$created_at"}, bucket_ms]}]}
+        log_duration = {"$multiply": [{"$log10": "$duration"}, BINS_PER_DECADE]}
+        duration_bin = {"$cond": [{"$gt": ["$duration", 0]}, {"$floor": log_duration}, None]}  # no fetch, no time
+        pipeline = [
+            {"$match": self._make_query(worker, None, since, until)},
+            {
+                "$group": {
+                    "_id": {"worker": "$worker", "bucket": bucket_start, "status": "$status", "bin": duration_bin},
+                    "count": {"$sum": 1},
+                },
+            },
+            {"$sort": {"_id.bucket": 1, "_id.worker": 1}},
+        ]
+
+        groups: Dict[Tuple[str, datetime], dict] = {}
+        histograms: Dict[Tuple[str, datetime], Dict[int, int]] = {}
+        for row in self.db.data.collection.aggregate(pipeline, allowDiskUse=True):
+            key = (row["_id"]["worker"], row["_id"]["bucket"])
+            group = groups.setdefault(key, {"worker": key[0], "bucket": key[1], "total": 0, "statuses": {}})
+            status = row["_id"]["status"]
+            group["total"] += row["count"]
+            group["statuses"][status] = group["statuses"].get(status, 0) + row["count"]
+            histogram = histograms.setdefault(key, {})
+            if row["_id"].get("bin") is not None:
+                value_bin = int(row["_id"]["bin"])
+                histogram[value_bin] = histogram.get(value_bin, 0) + row["count"]
+
+        result = []
+        for key, group in groups.items():
+            successes = sum(group["statuses"].get(status.value, 0) for status in (DataStatus.ok, DataStatus.unchanged))
+            errors = group["total"] - successes
+            group["error_rate"] = round(errors / group["total"], 4)
+            group["duration"] = {f"p{p}": histogram_percentile(histograms[key], p) for p in (50, 90, 99)}
+            result.append(group)
+        return result
+
+    def compact(self):
+        """Delete data by the retention settings and downsample old data, but not the records the dedup refers to.
+        It runs as a background job in every process, a lease on the Bot document lets only one of them do it
+        at a time."""
+        bot = self._lease_compaction()
+        if not bot:
+            return
+        try:
+            keep = self._referenced_ids()
+            deleted = self._delete_expired(keep)
+            downsampled = self._downsample(bot.downsampled_until, keep)
+            if deleted or downsampled:
+                total_deleted, total_downsampled = sum(deleted.values()), sum(downsampled.values())
+                self.log.info(f"data compaction: deleted={total_deleted}, downsampled={total_downsampled}")
+            if not self._recounted:
+                self._recount_workers()  # the workers created before Worker.data_count, once per process
+                self._recounted = True
+            else:
+                self._decrease_counts(deleted + downsampled)
+        finally:
+            self.db.bot.collection.update_one(
+                {"_id": 1, "compaction_owner": self.owner},
+                {"$set": {"compaction_owner": None, "compaction_until": None}},
+            )
+
+    def _lease_compaction(self) -> Optional[Bot]:
+        """The Bot document with the compaction state if this process got the lease, None otherwise.
+        The lease outlives a crashed process by data_compaction_interval at most."""
+        now = utc_now()
+        doc = self.db.bot.collection.find_one_and_update(
+            {"_id": 1, "$or": [{"compaction_until": None}, {"compaction_until": {"$lt": now}}]},
+            {
+                "$set": {
+                    "compaction_owner": self.owner,
+                    "compaction_until": now + timedelta(seconds=self.config.data_compaction_interval),
+                },
+            },
+            return_document=ReturnDocument.AFTER,
+        )
+        return Bot(**doc) if doc else None
+
+    def _referenced_ids(self) -> List[ObjectId]:
+        """The records of the last stored payloads (Worker.last_data_id). The dedup compares a new payload
+        with such a record and doesn't store an equal one again, so the record is kept while it's referenced."""
+        docs = self.db.worker.collection.find({"last_data_id": {"$ne": None}}, {"last_data_id": 1})
+        return [ObjectId(doc["last_data_id"]) for doc in docs]
+
+    def _recount_workers(self):
+        """Reset Worker.data_count, each count is a scan of the worker index only"""
+        for doc in self.db.worker.collection.find({}, {"name": 1}):
+            count = self.db.data.collection.count_documents({"worker": doc["name"]})
+            self.db.worker.collection.update_one({"_id": doc["_id"]}, {"$set": {"data_count": count}})
+
+    def _decrease_counts(self, deleted: Counter):
+        """Subtract the deleted records from Worker.data_count, a counter is never rescanned"""
+        updates = [UpdateOne({"name": name}, {"$inc": {"data_count": -count}}) for name, count in deleted.items()]
+        if updates:
+            self.db.worker.collection.bulk_write(updates, ordered=False)
+
+    def _delete_expired(self, keep: List[ObjectId]) -> Counter:
+        """Deleted records by worker"""
+        now = utc_now()
+        deleted: Counter = Counter()
+        overrides: Dict[str, List[str]] = {}  # status -> workers with their own retention for it
+        for worker in self.db.worker.find({"retention": {"$ne": {}}}):
+            for status, days in worker.retention.items():
+                if days <= 0:
+                    continue  # an invalid setting saved before it was validated, it would delete everything
+                overrides.setdefault(status, []).append(worker.name)
+                query = {"worker": worker.name, "status": status, "created_at": {"$lt": now - timedelta(days=days)}}
+                deleted += self._delete_in_batches(query, keep)
+
+        for status, days in self.system_service.get_bot().data_retention.items():
+            if days <= 0:
+                continue
+            query = {"status": status, "created_at": {"$lt": now - timedelta(days=days)}}
+            if status in overrides:
+                query["worker"] = {"$nin": overrides[status]}
+            deleted += self._delete_in_batches(query, keep)
+        return deleted
+
+    def _delete_in_batches(self, query: dict, keep: List[ObjectId]) -> Counter:
+        """delete_many by DELETE_BATCH ids at a time, so a large expiry isn't one long write holding the collection.
+        It returns the deleted records by worker, the compaction lease makes it the only delete of the records."""
+        if keep:
+            query = {**query, "_id": {"$nin": keep}}
+        deleted: Counter = Counter()
+        while True:
+            docs = list(self.db.data.collection.find(query, {"_id": 1, "worker": 1}).limit(DELETE_BATCH))
+            if not docs:
+                return deleted
+            self.db.data.collection.delete_many({"_id": {"$in": [doc["_id"] for doc in docs]}})
+            deleted.update(doc["worker"] for doc in docs)
+
+    def _downsample(self, downsampled_until: Optional[datetime], keep: List[ObjectId]) -> Counter:
+        """Keep only the latest sample per worker and hour for data older than Bot.downsample_after days.
+        Every run starts from where the previous one stopped (Bot.downsampled_until), so it doesn't rescan
+        downsampled data, not even after a restart."""
+        days = self.system_service.get_bot().downsample_after
+        if days <= 0:
+            return Counter()
+
+        until = utc_now() - timedelta(days=days)
+        query: dict = {"created_at": {"$lt": until}}
+        if downsampled_until:
+            query["created_at"]["$gte"] = downsampled_until - timedelta(hours=1)
+        hour_start = {"$subtract": ["$created_at", {"$mod": [{"$toLong": "$created_at"}, BUCKET_MS[DataBucket.hour]]}]}
+        pipeline = [
+            {"$match": query},
+            {"$sort": {"created_at": -1}},
+            {"$group": {"_id": {"worker": "$worker", "hour": hour_start}, "ids": {"$push": "$_id"}}},
+            {"$match": {"ids.1": {"$exists": True}}},
+        ]
+        deleted: Counter = Counter()
+        kept = set(keep)
+        for group in self.db.data.collection.aggregate(pipeline, allowDiskUse=True):
+            ids = [pk for pk in group["ids"][1:] if pk not in kept]
+            for i in range(0, len(ids), DELETE_BATCH):
+                end = i + DELETE_BATCH
+                batch = ids[i:end]
+                result = self.db.data.collection.delete_many({"_id": {"$in": batch}})
+                deleted[group["_id"]["worker"]] += result.deleted_count
+        self.db.bot.collection.update_one({"_id": 1}, {"$set": {"downsampled_until": until}})
+        return deleted
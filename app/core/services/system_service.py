@@ -1,15 +1,19 @@
 import threading
+import time
 import tracemalloc
 from logging import Logger
+from typing import AsyncIterator, Awaitable, Callable, Iterator, Optional, Tuple
 
-from telebot import TeleBot
-from telebot.util import split_string
+from pymongo import ReturnDocument
 from wrapt import synchronized
 
 from app.config import AppConfig
+from app.core import log_reader
 from app.core.db import DB
+from app.core.memory_snapshots import SnapshotStore
 from app.core.models import Bot
 from app.core.services import BaseService
+from app.core.telegram_sender import TelegramSender
 
 
 class SystemService(BaseService):
@@ -17,9 +21,18 @@ class SystemService(BaseService):
         super().__init__(config, log, db)
         self.logfile = self.config.data_dir + "/app.log"
         self._bot: Bot = self._init_bot()
+        self._stats: Optional[Tuple[float, dict]] = None  # the time it was taken at and the stats
+        self.memory_snapshots = SnapshotStore(config.tracemalloc_snapshot_limit, log)
+        self.telegram_sender = TelegramSender(
+            log,
+            self.get_bot,
+            config.telegram_queue_limit,
+            config.telegram_send_interval,
+        )
 
     def get_bot(self) -> Bot:
-        return self._bot.copy()
+        """The current settings snapshot. It's immutable, an update publishes a new one, so there is no copy."""
+        return self._bot
 
     def start_bot(self) -> Bot:
         self.update_bot({"bot_started": True})
@@ -31,28 +44,67 @@ class SystemService(BaseService):
 
     @synchronized
     def update_bot(self, updated: dict):
-        self._bot = self._bot.copy(update=updated)
-        self.db.bot.update_by_id(1, {"$set": updated})
+        doc = self.db.bot.collection.find_one_and_update(
+            {"_id": 1},
+            {"$set": updated, "$inc": {"version": 1}},
+            return_document=ReturnDocument.AFTER,
+        )
+        self._bot = Bot(**doc)
+
+    def sync_bot(self):
+        """Pick up the settings updated by other processes, only the version is read while nothing has changed"""
+        doc = self.db.bot.collection.find_one({"_id": 1}, {"version": 1})
+        if doc and doc.get("version", 0) != self._bot.version:
+            self._bot = self.db.bot.get(1)
 
     @synchronized
     def _init_bot(self) -> Bot:
         if not self.db.bot.get_or_none(1):
-            bot = Bot()
-            bot.id = 1
-            self.db.bot.insert_one(bot)
+            self.db.bot.insert_one(Bot(_id=1))
         return self.db.bot.get(1)
 
-    def read_logfile(self) -> str:
-        with open(self.logfile) as f:
-            return f.read()
+    def read_logfile(
+        self,
+        tail: Optional[int] = None,
+        offset: int = 0,
+        length: Optional[int] = None,
+        level: Optional[str] = None,
+        contains: Optional[str] = None,
+    ) -> Iterator[str]:
+        """The last `tail` lines, or the byte range from `offset`. Only the lines with the level and the substring
+        are kept if they are given. The file is streamed, it's never read into memory as a whole."""
+        line_filter = log_reader.make_filter(level, contains)
+        if tail is not None:
+            return iter(log_reader.tail(self.logfile, tail, line_filter))
+        return log_reader.read_range(self.logfile, offset, length, line_filter)
+
+    def follow_logfile(
+        self,
+        level: Optional[str] = None,
+        contains: Optional[str] = None,
+        is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+    ) -> AsyncIterator[str]:
+        line_filter = log_reader.make_filter(level, contains)
+        return log_reader.follow(self.logfile, line_filter, is_disconnected=is_disconnected)
 
     def clean_logfile(self):
         with open(self.logfile, "w") as f:
             f.write("")
         self.log.info("logfile was cleaned")
 
-    def get_stats(self):
-        return {"db": self.db.get_stats(), "threads": len(threading.enumerate())}
+    def get_stats(self) -> dict:
+        """Cached for AppConfig.stats_cache_ttl seconds, the data count of every worker is a counter on the worker"""
+        cached = self._stats
+        if cached and time.monotonic() - cached[0] < self.config.stats_cache_ttl:
+            return cached[1]
+        workers = self.db.worker.collection.find({}, {"name": 1, "data_count": 1})
+        stats = {
+            "db": self.db.get_stats(),
+            "data_by_worker": {w["name"]: w.get("data_count", 0) for w in workers},
+            "threads": len(threading.enumerate()),
+        }
+        self._stats = (time.monotonic(), stats)
+        return stats
 
     @staticmethod
     def tracemalloc_snapshot(key_type="lineno", limit=30) -> str:
@@ -62,19 +114,9 @@ class SystemService(BaseService):
             result += str(stat) + "\n"
         return result
 
-    def send_telegram_message(self, message: str):
-        """Send a telegram message to the project channel """
+    def send_telegram_message(self, message: str) -> bool:
+        """Send a telegram message to the project channel. It's queued, the result is False if it was dropped."""
         bot = self.get_bot()
         if bot.telegram_token and bot.telegram_channel and bot.telegram_channel_id:
-            threading.Thread(target=self._send_telegram_message, args=(message,)).start()
-
-    @synchronized
-    def _send_telegram_message(self, message: str):
-        try:
-            bot = TeleBot(self.get_bot().telegram_token)
-            chat_id = self.get_bot().telegram_channel_id
-            for text in split_string(message, 4096):
-                bot.send_message(chat_id, text)
-        except Exception as e:
-            self.log.error(f"send_telegram_message: {str(e)}")
-            return str(e)
+            return self.telegram_sender.send(message)
+        return False
@@ -1,20 +1,79 @@
+import functools
+import hashlib
+import json
+import os
+import socket
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from logging import Logger
-from typing import Any, Dict, List, Optional
+from threading import Condition, Thread
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
 
-from mb_commons import ParallelTasks, hrequest, synchronized_parameter, utc_now
+from bson import ObjectId
+from mb_commons import synchronized_parameter, utc_now
+from pymongo import ReturnDocument
 from wrapt import synchronized
 
-from app.config import AppConfig
+from app.config import AppConfig, FetchEngine
+from app.core import json_subset, metrics
+from app.core.circuit_breaker import CircuitBreaker
 from app.core.db import DB
-from app.core.models import Data, DataStatus, Worker, WorkerCreate
+from app.core.due_queue import DueQueue
+from app.core.fetcher import AsyncFetcher, FetchResponse, thread_fetch
+from app.core.host_limiter import HostLimiter
+from app.core.models import Data, DataStatus, DedupMode, Worker, WorkerCreate
 from app.core.services import BaseService
 from app.core.services.system_service import SystemService
+from app.core.worker_registry import WorkerRegistry
+from app.core.write_buffer import WriteBuffer
+
+CIRCUIT_OPEN = "circuit_open"
+CLAIM_RETRY_DELAY = 5  # in seconds, when a claim fails, e.g. the database is not available
+
+
+def content_hash(value: Any) -> str:
+    """A hash of the normalised json, the same data gives the same hash whatever the key order is"""
+    return hashlib.sha1(json.dumps(value, sort_keys=True, separators=(",", ":")).encode()).hexdigest()  # nosec
+
+
+def _host(url: str) -> str:
+    return urlparse(url).hostname or ""
+
+
+def _timestamp(value: datetime) -> float:
+    return value.replace(tzinfo=timezone.utc).timestamp()  # the database keeps naive UTC datetimes
 
 
 class WorkerService(BaseService):
     def __init__(self, config: AppConfig, log: Logger, db: DB, system_service: SystemService):
         super().__init__(config, log, db)
         self.system_service = system_service
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"  # lease owner of the claimed workers
+        self.async_fetcher: Optional[AsyncFetcher] = None
+        if config.fetch_engine == FetchEngine.asyncio:
+            self.async_fetcher = AsyncFetcher(config.fetch_limit, config.fetch_limit_per_host)
+        self.due_queue = DueQueue()
+        self.write_buffer = WriteBuffer(log, config.write_flush_size, config.write_flush_interval, config.write_limit)
+        self._running = False
+        self._executor = ThreadPoolExecutor(max_workers=config.fetch_limit, thread_name_prefix="work")
+        self._slots = Condition()
+        self._in_flight = 0  # workers dispatched and not finished yet
+        self._dispatched = 0
+        self._deferred = 0
+        self.host_limiter = HostLimiter()
+        self.circuit_breaker = CircuitBreaker()
+        self._hosts: Dict[str, str] = {}  # worker id -> host of its source
+        self._lag: Dict[str, float] = {}  # worker name -> seconds between its deadline and its dispatch
+        self._last_full_fetch: Dict[str, Tuple[int, float]] = {}  # worker id -> (body size, json parse time)
+        self.fetch_stats = {"not_modified": 0, "saved_bytes": 0, "saved_parse_time": 0.0}
+        self.workers_version = 0  # it changes when a worker is created or deleted, the ui caches depend on it
+        self.registry = WorkerRegistry()
+        # the gauges are read at scrape time, they cost nothing on the scheduler path
+        metrics.DUE_WORKERS.set_function(self.due_queue.count_due)
+        metrics.IN_FLIGHT_WORKERS.set_function(lambda: self._in_flight)
+        self._scheduler_thread = Thread(target=self._run_scheduler, name="worker_scheduler", daemon=True)
 
     @synchronized
     def create(self, worker: WorkerCreate) -> Worker:
@@ -22,77 +81,379 @@ class WorkerService(BaseService):
             raise ValueError(f"a worker with the name '{worker.name}' exists already")
 
         new_id = self.db.worker.insert_one(Worker(**worker.dict())).inserted_id
-        return self.db.worker.get(new_id)
-
-    def find_for_work(self) -> List[Worker]:
-        workers = self.db.worker.collection.aggregate(
-            [
-                {
-                    "$match": {
-                        "started": True,
+        new_worker = self.db.worker.get(new_id)
+        self.registry.put(new_worker)
+        self.workers_version += 1
+        if new_worker.started:
+            self._hosts[new_worker.id] = _host(new_worker.source)
+            self.due_queue.push(new_worker.id, self._worker_due_at(new_worker))
+        return new_worker
+
+    def find_for_work(self, limit: int) -> List[Worker]:
+        """Pop due workers and claim them. A worker which is claimed by another process or which is not due
+        according to the database (it was worked by another process) is rescheduled by the database state.
+        A worker whose host is at its rate or concurrency limit is put off without a database round trip."""
+        bot = self.system_service.get_bot()
+        due = self.due_queue.pop_due(limit)
+        workers = []
+        now = time.time()
+        for pk, due_at in due:
+            host = self._hosts.get(pk)
+            if host:
+                wait = self.host_limiter.acquire(host, bot.host_rps, bot.host_concurrency, waiter=pk)
+                if wait:
+                    self.due_queue.reschedule(pk, now + wait)
+                    self._deferred += 1
+                    continue
+            try:
+                worker = self._claim(pk)
+            except Exception as e:
+                worker = None
+                self.due_queue.reschedule(pk, now + CLAIM_RETRY_DELAY)  # due_at is in the past already
+                self.log.error(f"claim worker {pk}: {str(e)}")
+            if worker:
+                worker = self.registry.put_claimed(worker)  # etag, content_hash... can be ahead of the database
+                self._lag[worker.name] = now - due_at
+                if not host:
+                    self._hosts[pk] = _host(worker.source)
+                    self.host_limiter.acquire(self._hosts[pk], 0, 0)  # to be released as the others
+                workers.append(worker)
+            elif host:
+                self._release_host(host)
+        return workers
+
+    def _release_host(self, host: str):
+        """Free a slot of the host and wake the worker which waits for it, if any"""
+        waiter = self.host_limiter.release(host)
+        if waiter:
+            self.due_queue.reschedule(waiter, time.time())
+
+    def _claim(self, pk: str) -> Optional[Worker]:
+        now = utc_now()
+        lease = self.system_service.get_bot().timeout + self.config.write_flush_interval + self.config.lease_margin
+        is_due = {"$lte": ["$last_work_at", {"$subtract": [now, {"$multiply": ["$interval", 1000]}]}]}
+        doc = self.db.worker.collection.find_one_and_update(
+            {
+                "_id": ObjectId(pk),
+                "started": True,
+                "$and": [
+                    {"$or": [{"lease_until": None}, {"lease_until": {"$lt": now}}, {"lease_owner": self.owner}]},
+                    {
                         "$or": [
                             {"last_work_at": None},
-                            {
-                                "$expr": {
-                                    "$lt": [
-                                        "$checked_at",
-                                        {
-                                            "$subtract": [
-                                                "$$NOW",
-                                                {"$multiply": ["$interval", 1000]},
-                                            ],
-                                        },
-                                    ],
-                                },
-                            },
+                            {"next_work_at": {"$lte": now}},
+                            {"next_work_at": None, "$expr": is_due},
                         ],
                     },
-                },
-                {"$sort": {"last_work_at": 1}},
-                {"$limit": self.system_service.get_bot().worker_limit},
-            ],
+                ],
+            },
+            {"$set": {"lease_owner": self.owner, "lease_until": now + timedelta(seconds=lease)}},
+            return_document=ReturnDocument.AFTER,
         )
-        return [Worker(**w) for w in workers]
+        if doc:
+            return Worker(**doc)
+
+        worker = self.db.worker.get_or_none(pk)
+        if not worker or not worker.started:
+            self.due_queue.remove(pk)  # stopped or deleted by another process
+        else:
+            due_at = self._worker_due_at(worker)
+            if worker.lease_until and worker.lease_owner != self.owner:
+                due_at = max(due_at, _timestamp(worker.lease_until))
+            self.due_queue.reschedule(pk, due_at)
+
+    def sync_workers(self):
+        """Pick up the workers which were created, deleted, started or stopped by other processes. It reads
+        the ids and the started flags, and the whole documents of the new workers only. The rest of the registry
+        is kept, it's ahead of the database by the writes pending in the write buffer."""
+        docs = self.db.worker.collection.find({}, {"started": 1})
+        started = {str(doc["_id"]): doc.get("started", False) for doc in docs}
+        known = {w.id for w in self.registry.all()}
+        if set(started) != known:
+            self.workers_version += 1
+        for pk in known - set(started):
+            self.registry.remove(pk)
+            self.due_queue.remove(pk)
+        new_ids = [ObjectId(pk) for pk in started if pk not in known]
+        for worker in self.db.worker.find({"_id": {"$in": new_ids}}) if new_ids else []:
+            self.registry.put(worker)
+        for pk, is_started in started.items():
+            worker = self.registry.get(pk)
+            if not worker:
+                continue  # deleted between the reads
+            if worker.started != is_started:
+                self.registry.update(pk, {"started": is_started})
+            if is_started and pk not in self.due_queue:
+                self._hosts[pk] = _host(worker.source)
+                self.due_queue.push(pk, self._worker_due_at(worker))
 
     def start_worker(self, pk) -> Optional[Worker]:
-        return self.db.worker.find_by_id_and_update(pk, {"$set": {"started": True}})
+        worker = self.db.worker.find_by_id_and_update(pk, {"$set": {"started": True}})
+        if worker:
+            worker = self.registry.merge(worker, ["started"])
+            self._hosts[worker.id] = _host(worker.source)
+            if worker.id not in self.due_queue:  # it's scheduled or in flight already, a push would run it twice
+                self.due_queue.push(worker.id, self._worker_due_at(worker))
+        return worker
 
     def stop_worker(self, pk) -> Optional[Worker]:
-        return self.db.worker.find_by_id_and_update(pk, {"$set": {"started": False}})
+        self.due_queue.remove(pk)
+        worker = self.db.worker.find_by_id_and_update(pk, {"$set": {"started": False}})
+        if worker:
+            worker = self.registry.merge(worker, ["started"])
+        return worker
+
+    def update_retention(self, pk, retention: Dict[DataStatus, int]) -> Optional[Worker]:
+        retention_days = {status.value: days for status, days in retention.items()}
+        worker = self.db.worker.find_by_id_and_update(pk, {"$set": {"retention": retention_days}})
+        if worker:
+            worker = self.registry.merge(worker, ["retention"])
+        return worker
+
+    def delete_worker(self, pk):
+        self.due_queue.remove(pk)
+        self.registry.remove(pk)
+        self.workers_version += 1
+        return self.db.worker.delete_by_id(pk)
+
+    def start(self):
+        """Seed the deadlines from the database and start the scheduler thread"""
+        self.sync_workers()
+        self._running = True
+        self.write_buffer.start()
+        self._scheduler_thread.start()
+
+    def _run_scheduler(self):
+        while self._running:
+            with self._slots:
+                while self._running and self._in_flight >= self.system_service.get_bot().worker_limit:
+                    self._slots.wait()
+            self.due_queue.wait()
+            if not self._running:
+                break
+            try:
+                self.process_workers()
+            except Exception as e:
+                self.log.exception(f"process_workers: {str(e)}")
+
+    @staticmethod
+    def _due_at(last_work_at: Optional[datetime], next_work_at: Optional[datetime], interval: int) -> float:
+        if next_work_at:
+            return _timestamp(next_work_at)
+        return _timestamp(last_work_at) + interval if last_work_at else time.time()
+
+    def _worker_due_at(self, worker: Worker) -> float:
+        return self._due_at(worker.last_work_at, worker.next_work_at, worker.interval)
+
+    def _next_delay(self, worker: Worker, failures: int, unchanged_streak: int) -> float:
+        """Seconds until the next fetch. In the adaptive mode a failing worker backs off exponentially,
+        and so does a worker with an unchanged payload if Bot.slow_unchanged is on."""
+        bot = self.system_service.get_bot()
+        if not bot.adaptive_polling:
+            return worker.interval
+        streak = failures or (unchanged_streak if bot.slow_unchanged else 0)
+        return min(worker.interval * 2 ** min(streak, 20), max(bot.max_backoff, worker.interval))
+
+    def work(self, pk) -> bool:
+        return self._work(pk) is not None
 
     @synchronized_parameter(arg_index=1)
-    def work(self, pk):
+    def _work(self, pk, claimed: Optional[Worker] = None, fetched: Optional[FetchResponse] = None) -> Optional[float]:
+        """Fetch and save the data of the worker, it returns the delay until the next fetch.
+        A manual run reads the worker, the scheduler passes the one it has claimed and, with the asyncio engine,
+        the response fetched already. Both go through this per-pk lock, so the results of a worker are saved
+        one at a time, each on top of the state left by the previous one."""
         self.log.debug("work(%s)", pk)
-        worker = self.db.worker.get_or_none(pk)
-        if not worker or not worker.started:
-            return False
+        if claimed:
+            worker = self.registry.get(pk) or claimed  # a manual run could finish while this one was waiting
+        else:
+            worker = self.db.worker.get_or_none(pk)
+            if not worker or not worker.started:
+                self.due_queue.remove(pk)
+                return None
+
+        return self._save_result(worker, fetched if fetched is not None else self._fetch(worker))
+
+    def _fetch(self, worker: Worker) -> FetchResponse:
+        timeout = self.system_service.get_bot().timeout
+        if not self._is_circuit_closed(worker):
+            return FetchResponse(error=CIRCUIT_OPEN)
+        headers, max_size = self._conditional_headers(worker), self._max_size(worker)
+        if self.async_fetcher:
+            return self.async_fetcher.fetch(worker.source, timeout, headers, max_size)
+        return thread_fetch(worker.source, timeout, headers, max_size)
 
-        r = hrequest(worker.source, timeout=self.system_service.get_bot().timeout)
-        worker_updated = {"last_work_at": utc_now()}
-        data: Dict[str, Any] = {"worker": worker.name}
-        if r.is_timeout_error():
+    def _max_size(self, worker: Worker) -> int:
+        return worker.max_size if worker.max_size is not None else self.system_service.get_bot().max_response_size
+
+    def _is_circuit_closed(self, worker: Worker) -> bool:
+        bot = self.system_service.get_bot()
+        return self.circuit_breaker.allow(_host(worker.source), bot.breaker_threshold, bot.breaker_cooldown)
+
+    @staticmethod
+    def _conditional_headers(worker: Worker) -> Dict[str, str]:
+        headers = {}
+        if worker.etag:
+            headers["If-None-Match"] = worker.etag
+        if worker.last_modified:
+            headers["If-Modified-Since"] = worker.last_modified
+        return headers
+
+    def _save_result(self, worker: Worker, res: FetchResponse) -> float:
+        worker_updated: Dict[str, Any] = {"last_work_at": utc_now(), "lease_owner": None, "lease_until": None}
+        data: Dict[str, Any] = {"worker": worker.name, "http_code": res.http_code or None, "size": res.size}
+        for field in ["duration", "dns_duration", "connect_duration", "first_byte_duration"]:
+            value = getattr(res, field)
+            data[field] = round(value, 4) if value is not None else None
+        if res.error == CIRCUIT_OPEN:
+            data["status"] = DataStatus.circuit_open
+        elif res.is_timeout_error():
             data["status"] = DataStatus.timeout
-        elif not r.is_error():
-            if r.json_parse_error:
+        elif res.is_too_large():
+            data["status"] = DataStatus.too_large
+        elif not res.is_error():
+            if res.is_not_modified():
+                data["status"] = DataStatus.unchanged
+                self._count_not_modified(worker)
+            elif res.json_parse_error:
                 data["status"] = DataStatus.json_error
             else:
                 data["status"] = DataStatus.ok
-                data["data"] = r.json
+                data["data"] = json_subset.pick(res.json, worker.fields)
+                worker_updated["etag"] = res.get_header("ETag")
+                worker_updated["last_modified"] = res.get_header("Last-Modified")
+                self._last_full_fetch[worker.id] = (res.size, res.parse_duration)
         else:
             data["status"] = DataStatus.error
 
-        self.db.data.insert_one(Data(**data))
-        self.db.worker.update_by_id(pk, {"$set": worker_updated})
-        return True
+        dedup_mode = self.system_service.get_bot().dedup_mode
+        if data["status"] == DataStatus.ok and dedup_mode != DedupMode.off:
+            data["content_hash"] = content_hash(data["data"])
+            if data["content_hash"] == worker.content_hash and worker.last_data_id:
+                data["status"] = DataStatus.unchanged
+                data["data"] = None
+            else:
+                data["id"] = str(ObjectId())
+                worker_updated["content_hash"] = data["content_hash"]
+                worker_updated["last_data_id"] = data["id"]
 
-    @synchronized
-    def process_workers(self):
-        self.log.debug("WorkerService.process_workers()")
-        workers = self.find_for_work()
-        if not workers:
-            return
-
-        tasks = ParallelTasks(max_workers=self.system_service.get_bot().worker_limit)
-        for w in workers:
-            tasks.add_task(f"work_{w.name}", self.work, args=(w.id,))
-        tasks.execute()
+        inserted = 0
+        if data["status"] == DataStatus.unchanged and dedup_mode == DedupMode.counter and worker.last_data_id:
+            bump = {"$inc": {"repeats": 1}, "$set": {"last_seen_at": utc_now()}}
+            self.write_buffer.update_by_id(self.db.data, worker.last_data_id, bump)
+        else:
+            self.write_buffer.insert_one(self.db.data, Data(**data))
+            inserted = 1
+
+        if data["status"] != DataStatus.circuit_open:  # no request was made, its duration is 0
+            metrics.FETCH_DURATION.labels(data["status"].value, _host(worker.source)).observe(res.duration)
+        failed = data["status"] in (DataStatus.timeout, DataStatus.error, DataStatus.too_large)
+        if data["status"] == DataStatus.circuit_open:
+            worker_updated["failures"] = worker.failures  # the host is down, not the worker: keep its backoff
+        else:
+            host_failed = data["status"] in (DataStatus.timeout, DataStatus.error)
+            threshold = self.system_service.get_bot().breaker_threshold
+            self.circuit_breaker.record(_host(worker.source), not host_failed, threshold)
+            worker_updated["failures"] = worker.failures + 1 if failed else 0
+        unchanged = data["status"] == DataStatus.unchanged
+        worker_updated["unchanged_streak"] = worker.unchanged_streak + 1 if unchanged else 0
+        delay = self._next_delay(worker, worker_updated["failures"], worker_updated["unchanged_streak"])
+        worker_updated["next_work_at"] = worker_updated["last_work_at"] + timedelta(seconds=delay)
+        worker_update = {"$set": worker_updated, "$inc": {"data_count": inserted}}
+        self.write_buffer.update_by_id(self.db.worker, worker.id, worker_update)
+        self.registry.update(worker.id, {**worker_updated, "data_count": worker.data_count + inserted})
+        return delay
+
+    def _count_not_modified(self, worker: Worker):
+        """A 304 response saves the body download and the json parsing of the last full response"""
+        size, parse_duration = self._last_full_fetch.get(worker.id, (0, 0.0))
+        self.fetch_stats["not_modified"] += 1
+        self.fetch_stats["saved_bytes"] += size
+        self.fetch_stats["saved_parse_time"] += parse_duration
+
+    def process_workers(self) -> int:
+        """Dispatch due workers into the free fetch slots and return at once.
+        A slot is released as soon as its fetch is done, there is no waiting for the rest of the workers."""
+        with self._slots:
+            free_slots = self.system_service.get_bot().worker_limit - self._in_flight
+        if free_slots <= 0:
+            return 0
+        with metrics.SCHEDULER_TICK_DURATION.time():
+            workers = self.find_for_work(free_slots)
+            for worker in workers:
+                with self._slots:
+                    self._in_flight += 1
+                    self._dispatched += 1
+                if self.async_fetcher and not self._is_circuit_closed(worker):
+                    future = Future()
+                    future.set_result(FetchResponse(error=CIRCUIT_OPEN))
+                    self._executor.submit(self._save_fetched, worker, future)
+                elif self.async_fetcher:
+                    timeout = self.system_service.get_bot().timeout
+                    headers, max_size = self._conditional_headers(worker), self._max_size(worker)
+                    future = self.async_fetcher.submit(worker.source, timeout, headers, max_size)
+                    future.add_done_callback(functools.partial(self._on_fetched, worker))
+                else:
+                    self._executor.submit(self._dispatch, worker)
+        metrics.SCHEDULER_DISPATCHED.observe(len(workers))
+        return len(workers)
+
+    def _dispatch(self, worker: Worker):
+        # the worker was just claimed with find_one_and_update, it's the current state and there is no reread
+        delay = None
+        try:
+            delay = self._work(worker.id, worker)
+        finally:
+            self._release_slot(worker, delay)
+
+    def _on_fetched(self, worker: Worker, future: Future):
+        # it's called from the event loop thread, keep blocking database writes away from it
+        self._executor.submit(self._save_fetched, worker, future)
+
+    def _save_fetched(self, worker: Worker, future: Future):
+        delay = None
+        try:
+            delay = self._work(worker.id, worker, future.result())
+        finally:
+            self._release_slot(worker, delay)
+
+    def _release_slot(self, worker: Worker, delay: Optional[float]):
+        self._release_host(_host(worker.source))
+        self.due_queue.reschedule(worker.id, time.time() + (worker.interval if delay is None else delay))
+        with self._slots:
+            self._in_flight -= 1
+            self._slots.notify_all()
+
+    def get_dispatch_stats(self) -> dict:
+        worker_limit = self.system_service.get_bot().worker_limit
+        lag = dict(self._lag)
+        return {
+            "queue_depth": self.due_queue.count_due(),
+            "scheduled": len(self.due_queue),
+            "in_flight": self._in_flight,
+            "worker_limit": worker_limit,
+            "slot_utilization": round(self._in_flight / worker_limit, 3) if worker_limit else 0,
+            "dispatched": self._dispatched,
+            "deferred": self._deferred,  # put off by the host limits
+            "hosts_in_flight": self.host_limiter.get_stats(),
+            "lag_max": round(max(lag.values()), 3) if lag else 0,
+            "lag_avg": round(sum(lag.values()) / len(lag), 3) if lag else 0,
+            "lag": {name: round(value, 3) for name, value in lag.items()},
+            "fetch": {**self.fetch_stats, "saved_parse_time": round(self.fetch_stats["saved_parse_time"], 3)},
+        }
+
+    def close(self):
+        """Stop dispatching, let the in-flight fetches be saved and flush the write buffer. The order matters:
+        an asyncio fetch is saved through the executor, so the executor must outlive the fetcher."""
+        self._running = False
+        while self._scheduler_thread.is_alive():  # notify again, it could be on its way into a wait
+            self.due_queue.notify()
+            with self._slots:
+                self._slots.notify_all()
+            self._scheduler_thread.join(0.1)
+        with self._slots:
+            self._slots.wait_for(lambda: self._in_flight == 0, timeout=self.system_service.get_bot().timeout + 1)
+        if self.async_fetcher:
+            self.async_fetcher.close()
+        self._executor.shutdown(wait=True)
+        self.write_buffer.stop()
@@ -0,0 +1,114 @@
+import threading
+import time
+from collections import deque
+from logging import Logger
+from typing import Callable, Deque, List, Optional, Tuple
+
+from telebot import TeleBot
+from telebot.util import split_string
+
+from app.core.models import Bot
+
+MAX_LENGTH = 4096  # of a telegram message
+
+
+def coalesce(messages: List[str], max_length: int = MAX_LENGTH) -> List[str]:
+    """Join the messages into as few texts as possible, a message is split only if it's longer than max_length"""
+    result: List[str] = []
+    current = ""
+    for message in messages:
+        for part in split_string(message, max_length):
+            if current and len(current) + 2 + len(part) <= max_length:
+                current += "\n\n" + part
+            else:
+                if current:
+                    result.append(current)
+                current = part
+    if current:
+        result.append(current)
+    return result
+
+
+class TelegramSender:
+    """A single thread which sends the messages to the project channel. The queue is bounded: on overflow
+    the new messages are dropped and counted, and a note with the count goes with the next batch.
+    Queued messages are coalesced into texts of up to 4096 chars, sent at most one per `interval` seconds."""
+
+    def __init__(self, log: Logger, get_bot: Callable[[], Bot], limit: int, interval: float):
+        self.log = log
+        self.get_bot = get_bot
+        self.limit = limit
+        self.interval = interval
+        self.stats = {"sent": 0, "dropped": 0, "errors": 0}
+        self._queue: Deque[str] = deque()
+        self._dropped_since_last_send = 0
+        self._cond = threading.Condition()
+        self._client: Optional[Tuple[str, TeleBot]] = None  # the token and the client, it's kept between messages
+        self._last_sent_at = 0.0
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="telegram_sender", daemon=True)
+        self._thread.start()
+
+    def send(self, message: str) -> bool:
+        """Queue the message, it returns False if the queue is full and the message was dropped"""
+        with self._cond:
+            if len(self._queue) >= self.limit:
+                self.stats["dropped"] += 1
+                self._dropped_since_last_send += 1
+                return False
+            self._queue.append(message)
+            self._cond.notify()
+            return True
+
+    def get_stats(self) -> dict:
+        with self._cond:
+            return {**self.stats, "queued": len(self._queue)}
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        self._thread.join()
+
+    def _take_all(self) -> List[str]:
+        with self._cond:
+            while self._running and not self._queue:
+                self._cond.wait()
+            messages = list(self._queue)
+            self._queue.clear()
+            if self._dropped_since_last_send:
+                messages.append(f"... {self._dropped_since_last_send} messages were dropped, the queue was full")
+                self._dropped_since_last_send = 0
+            return messages
+
+    def _run(self):
+        while messages := self._take_all():  # it's empty only when stopped and everything is sent
+            for text in coalesce(messages):
+                self._send_with_rate_limit(text)
+
+    def _send_with_rate_limit(self, text: str, retry: bool = True):
+        wait = self._last_sent_at + self.interval - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        try:
+            if self._send(text):
+                self.stats["sent"] += 1
+        except Exception as e:
+            # telegram replies 429 with retry_after on flood, there is one more try after that delay
+            retry_after = (getattr(e, "result_json", None) or {}).get("parameters", {}).get("retry_after")
+            if retry and retry_after:
+                time.sleep(retry_after)
+                return self._send_with_rate_limit(text, retry=False)
+            self.stats["errors"] += 1
+            self.log.error(f"send_telegram_message: {str(e)}")
+        finally:
+            self._last_sent_at = time.monotonic()
+
+    def _send(self, text: str) -> bool:
+        bot = self.get_bot()
+        if not (bot.telegram_token and bot.telegram_channel and bot.telegram_channel_id):
+            return False  # the channel was turned off after the message was queued
+        if self._client is None or self._client[0] != bot.telegram_token:
+            self._client = (bot.telegram_token, TeleBot(bot.telegram_token))
+        self._client[1].send_message(bot.telegram_channel_id, text)
+        return True
@@ -0,0 +1,70 @@
+import threading
+from datetime import timezone
+from typing import Dict, List, Optional
+
+from app.core.models import Worker
+
+
+def _worked_at(worker: Worker) -> float:
+    # the database keeps naive UTC datetimes
+    return worker.last_work_at.replace(tzinfo=timezone.utc).timestamp() if worker.last_work_at else 0
+
+
+class WorkerRegistry:
+    """All the workers in memory, by id and by name. WorkerService keeps it up to date on its own changes,
+    and WorkerService.sync_workers picks up the workers created, deleted, started or stopped by other processes.
+    The registry is ahead of the database by the writes pending in the write buffer, so a worker read from
+    the database doesn't replace the one in the registry, unless it was worked by another process since."""
+
+    def __init__(self):
+        self._by_id: Dict[str, Worker] = {}
+        self._by_name: Dict[str, Worker] = {}
+        self._lock = threading.Lock()
+
+    def put(self, worker: Worker):
+        with self._lock:
+            old = self._by_id.get(worker.id)
+            if old and old.name != worker.name:
+                self._by_name.pop(old.name, None)
+            self._by_id[worker.id] = worker  # type:ignore
+            self._by_name[worker.name] = worker
+
+    def merge(self, worker: Worker, fields: List[str]) -> Worker:
+        """Take only `fields` of a worker read from the database, unless the worker is new. It returns the result."""
+        if worker.id in self._by_id:
+            self.update(worker.id, {field: getattr(worker, field) for field in fields})
+        else:
+            self.put(worker)
+        return self._by_id[worker.id]  # type:ignore
+
+    def put_claimed(self, claimed: Worker) -> Worker:
+        """Take the lease of a worker claimed in the database and return the worker to work"""
+        known = self._by_id.get(claimed.id)
+        if known and _worked_at(claimed) > _worked_at(known):
+            self.put(claimed)  # another process has worked it since
+        return self.merge(claimed, ["lease_owner", "lease_until"])
+
+    def update(self, pk: str, updated: dict):
+        with self._lock:
+            worker = self._by_id.get(pk)
+            if worker:
+                worker = worker.copy(update=updated)
+                self._by_id[pk] = self._by_name[worker.name] = worker
+
+    def remove(self, pk: str):
+        with self._lock:
+            worker = self._by_id.pop(pk, None)
+            if worker:
+                self._by_name.pop(worker.name, None)
+
+    def get(self, pk: str) -> Optional[Worker]:
+        return self._by_id.get(pk)
+
+    def get_by_name(self, name: str) -> Optional[Worker]:
+        return self._by_name.get(name)
+
+    def all(self) -> List[Worker]:
+        return list(self._by_id.values())
+
+    def __len__(self) -> int:
+        return len(self._by_id)
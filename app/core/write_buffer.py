@@ -0,0 +1,227 @@
+import threading
+from logging import Logger
+from typing import Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from mb_commons.mongo import MongoCollection, MongoModel
+from pymongo import UpdateOne
+from pymongo.collection import Collection
+from pymongo.errors import (
+    AutoReconnect,
+    BulkWriteError,
+    ConnectionFailure,
+    InvalidDocument,
+    ServerSelectionTimeoutError,
+)
+
+DUPLICATE_KEY_ERROR = 11000
+# the server error codes of a write which can succeed on a retry: not primary, shutting down, network errors
+RETRYABLE_CODES = {6, 7, 89, 91, 189, 262, 9001, 10058, 10107, 11600, 11602, 13435, 13436}
+TRANSIENT_ERRORS = (AutoReconnect, ConnectionFailure, ServerSelectionTimeoutError)
+Update = Tuple[dict, dict]  # the filter and the update document
+
+
+def _without_inc(update: dict) -> dict:
+    return {op: value for op, value in update.items() if op != "$inc"}
+
+
+class WriteBuffer:
+    """Write-behind buffer. Inserts are grouped into one insert_many and updates into one unordered bulk_write
+    per collection. It's flushed when `flush_size` writes are pending, every `flush_interval` seconds and on stop().
+
+    Only the writes which failed on a transient error (no server, a broken connection, not primary) are retried.
+    An insert is retried as is, it has its _id already. An update of a batch whose outcome is unknown
+    (the connection broke in the middle of it) is retried without its $inc part: a counter can miss
+    an increment, but it's never incremented twice. A write which can never succeed, e.g. a document over 16 MB,
+    is bisected out of its batch, logged and dropped, so it doesn't hold back the rest.
+
+    At most `limit` writes are kept in memory: a writer which hits the limit flushes by itself. If the database
+    is not available, the oldest pending writes above the limit are dropped, the updates first: an update
+    can point to a pending insert (Worker.last_data_id), an insert never points to an update."""
+
+    def __init__(self, log: Logger, flush_size: int, flush_interval: float, limit: int):
+        self.log = log
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.limit = limit
+        self._collections: Dict[str, Collection] = {}
+        self._inserts: Dict[str, List[dict]] = {}
+        self._updates: Dict[str, List[Update]] = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._running = False
+        self._thread = threading.Thread(target=self._run, name="write_buffer", daemon=True)
+        self.stats = {"flushes": 0, "written": 0, "dropped": 0, "errors": 0}
+
+    def insert_one(self, col: MongoCollection, obj: MongoModel):
+        doc = obj.to_doc()
+        if doc.get("_id") is None:
+            doc.pop("_id", None)
+        elif isinstance(doc["_id"], str) and ObjectId.is_valid(doc["_id"]):
+            doc["_id"] = ObjectId(doc["_id"])  # an id assigned before the insert
+        self._add(col.collection, insert=doc)
+
+    def update_by_id(self, col: MongoCollection, pk, update: dict):
+        pk = ObjectId(pk) if isinstance(pk, str) and ObjectId.is_valid(pk) else pk
+        self._add(col.collection, update=({"_id": pk}, update))
+
+    def _add(self, collection: Collection, insert: Optional[dict] = None, update: Optional[Update] = None):
+        with self._lock:
+            self._collections[collection.name] = collection
+            if insert is not None:
+                self._inserts.setdefault(collection.name, []).append(insert)
+            if update is not None:
+                self._updates.setdefault(collection.name, []).append(update)
+            self._pending += 1
+            pending = self._pending
+        if pending >= self.limit:
+            self.flush()
+            self._drop_over_limit()
+        elif pending >= self.flush_size:
+            self._wakeup.set()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                inserts, self._inserts = self._inserts, {}
+                updates, self._updates = self._updates, {}
+                self._pending = 0
+            if not inserts and not updates:
+                return
+
+            failed_inserts: Dict[str, List[dict]] = {}
+            failed_updates: Dict[str, List[Update]] = {}
+            dropped = self.stats["dropped"]
+            # inserts go first, an update can target a document from the same flush
+            for name, docs in inserts.items():
+                failed = self._write_inserts(self._collections[name], docs)
+                self.stats["written"] += len(docs) - len(failed)
+                if failed:
+                    failed_inserts[name] = failed
+            if failed_inserts:
+                failed_updates = updates  # not sent at all, they wait for the inserts they can depend on
+            else:
+                for name, requests in updates.items():
+                    failed = self._write_updates(self._collections[name], requests)
+                    self.stats["written"] += len(requests) - len(failed)
+                    if failed:
+                        failed_updates[name] = failed
+            self.stats["written"] -= self.stats["dropped"] - dropped  # they are not failed, but not written either
+            self.stats["flushes"] += 1
+
+            if failed_inserts or failed_updates:
+                self._requeue(failed_inserts, failed_updates)
+
+    def _write_inserts(self, collection: Collection, docs: List[dict]) -> List[dict]:
+        """insert_many, it returns the docs to retry"""
+        try:
+            collection.insert_many(docs, ordered=False)
+            return []
+        except BulkWriteError as e:
+            # insert_many sets _id on the docs, so a retry hits the documents inserted by the previous try
+            errors = [err for err in e.details["writeErrors"] if err["code"] != DUPLICATE_KEY_ERROR]
+            if errors:
+                self._log_error("insert_many", collection, f"{len(errors)} failed: {errors[0].get('errmsg')}")
+            self._drop(collection, [err for err in errors if err["code"] not in RETRYABLE_CODES])
+            return [docs[err["index"]] for err in errors if err["code"] in RETRYABLE_CODES]
+        except InvalidDocument as e:
+            if len(docs) > 1:
+                middle = len(docs) // 2
+                return self._write_inserts(collection, docs[:middle]) + self._write_inserts(collection, docs[middle:])
+            self._log_error("insert_many", collection, f"{type(e).__name__}: {str(e)}")
+            self._drop(collection, docs)
+            return []
+        except TRANSIENT_ERRORS as e:
+            self._log_error("insert_many", collection, str(e))
+            return docs
+        except Exception as e:
+            self._log_error("insert_many", collection, f"{type(e).__name__}: {str(e)}")
+            self._drop(collection, docs)
+            return []
+
+    def _write_updates(self, collection: Collection, updates: List[Update]) -> List[Update]:
+        """An unordered bulk_write, it returns the updates to retry"""
+        try:
+            collection.bulk_write([UpdateOne(query, update) for query, update in updates], ordered=False)
+            return []
+        except BulkWriteError as e:
+            # the batch is unordered: everything but the updates with a write error is applied
+            errors = e.details["writeErrors"]
+            if errors:
+                self._log_error("bulk_write", collection, f"{len(errors)} failed: {errors[0].get('errmsg')}")
+            self._drop(collection, [err for err in errors if err["code"] not in RETRYABLE_CODES])
+            return [updates[err["index"]] for err in errors if err["code"] in RETRYABLE_CODES]
+        except InvalidDocument as e:
+            if len(updates) > 1:
+                middle = len(updates) // 2
+                first, second = updates[:middle], updates[middle:]
+                return self._write_updates(collection, first) + self._write_updates(collection, second)
+            self._log_error("bulk_write", collection, f"{type(e).__name__}: {str(e)}")
+            self._drop(collection, updates)
+            return []
+        except ServerSelectionTimeoutError as e:
+            self._log_error("bulk_write", collection, str(e))
+            return updates  # no server was found, nothing was sent
+        except TRANSIENT_ERRORS as e:
+            self._log_error("bulk_write", collection, str(e) + ", the outcome is unknown, $inc is not retried")
+            return [(query, _without_inc(update)) for query, update in updates if _without_inc(update)]
+        except Exception as e:
+            self._log_error("bulk_write", collection, f"{type(e).__name__}: {str(e)}")
+            self._drop(collection, updates)
+            return []
+
+    def _drop(self, collection: Collection, writes: list):
+        if writes:
+            self.stats["dropped"] += len(writes)
+            self.log.error(f"write_buffer: dropped {len(writes)} writes into {collection.name}, they can't succeed")
+
+    def _log_error(self, operation: str, collection: Collection, message: str):
+        self.stats["errors"] += 1
+        self.log.error(f"write_buffer: {operation} into {collection.name}: {message}")
+
+    def _requeue(self, inserts: Dict[str, List[dict]], updates: Dict[str, List[Update]]):
+        with self._lock:
+            for name, docs in inserts.items():
+                self._inserts[name] = docs + self._inserts.get(name, [])
+                self._pending += len(docs)
+            for name, requests in updates.items():
+                self._updates[name] = requests + self._updates.get(name, [])
+                self._pending += len(requests)
+
+    def _drop_over_limit(self):
+        with self._lock:
+            for pending in [self._updates, self._inserts]:
+                for name in pending:
+                    over = self._pending - self.limit
+                    if over <= 0:
+                        return
+                    dropped = pending[name][:over]  # type:ignore
+                    pending[name] = pending[name][over:]  # type:ignore
+                    self._pending -= len(dropped)
+                    self.stats["dropped"] += len(dropped)
+                    self.log.error(f"write_buffer: dropped {len(dropped)} writes into {name}, the limit is reached")
+
+    def _run(self):
+        while self._running:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                self.log.exception(f"write_buffer: {str(e)}")
+
+    def start(self):
+        self._running = True
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._wakeup.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.flush()
+
+    def get_stats(self) -> dict:
+        return {"pending": self._pending, **self.stats}
@@ -1,9 +1,11 @@
+import time
 from datetime import datetime
 from enum import Enum
 from functools import partial
 from pathlib import Path
-from typing import List, Optional, Type, Union
+from typing import Any, Callable, List, Optional, Type, Union
 
+from jinja2 import FileSystemBytecodeCache
 from markupsafe import Markup
 from starlette.templating import Jinja2Templates
 
@@ -65,19 +67,49 @@ def raise_(msg):
     raise Exception(msg)
 
 
+class CachedGlobal:
+    """A template global which is computed again only if its version has changed or after ttl seconds"""
+
+    def __init__(self, func: Callable[[], Any], version: Callable[[], Any], ttl: int):
+        self.func = func
+        self.version = version
+        self.ttl = ttl
+        self._cached: Optional[tuple] = None  # version, computed at, value
+
+    def __call__(self):
+        version, cached = self.version(), self._cached
+        if cached and cached[0] == version and time.monotonic() - cached[1] < self.ttl:
+            return cached[2]
+        value = self.func()
+        self._cached = (version, time.monotonic(), value)
+        return value
+
+
 def header_info(core: Core):
     info = f"bot: {yes_no(core.system_service.get_bot().bot_started, on_off=True)}"
     return Markup(info)
 
 
 def footer_info(core: Core):
-    info = f"workers: {core.db.worker.count({})}"
+    info = f"workers: {len(core.worker_service.registry)}"
     return Markup(info)
 
 
+def bot_version(core: Core) -> int:
+    return core.system_service.get_bot().version
+
+
+def workers_version(core: Core) -> int:
+    return core.worker_service.workers_version
+
+
 def configure_jinja(core: Core) -> Jinja2Templates:
     current_dir = Path(__file__).parent.absolute()
     templates = Jinja2Templates(directory=current_dir.joinpath("templates"))
+    cache_dir = Path(core.config.data_dir).joinpath("jinja_cache")
+    cache_dir.mkdir(exist_ok=True)
+    templates.env.bytecode_cache = FileSystemBytecodeCache(str(cache_dir))
+    templates.env.auto_reload = core.config.debug  # don't stat the template files on every render in production
     templates.env.filters["timestamp"] = timestamp
     templates.env.filters["dt"] = timestamp
     templates.env.filters["empty"] = empty
@@ -87,8 +119,13 @@ def configure_jinja(core: Core) -> Jinja2Templates:
     templates.env.globals["config"] = core.config
     templates.env.globals["now"] = datetime.utcnow
     templates.env.globals["raise"] = raise_
-    templates.env.globals["header_info"] = partial(header_info, core)
-    templates.env.globals["footer_info"] = partial(footer_info, core)
+    ttl = core.config.ui_cache_ttl
+    templates.env.globals["header_info"] = CachedGlobal(partial(header_info, core), partial(bot_version, core), ttl)
+    templates.env.globals["footer_info"] = CachedGlobal(
+        partial(footer_info, core),
+        partial(workers_version, core),
+        ttl,
+    )
     templates.env.globals["confirm"] = """ onclick="return confirm('sure?')" """
 
     return templates
@@ -0,0 +1,89 @@
+import time
+from typing import Dict
+
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+
+from app.core.errors import UserError
+from app.core.metrics import HTTP_DURATION
+from app.core.models import ProfileFormat
+from app.core.profiler import Sampler
+
+
+def profile_response(sampler: Sampler, profile_format: ProfileFormat) -> Response:
+    if profile_format == ProfileFormat.speedscope:
+        headers = {"Content-Disposition": "attachment; filename=profile.speedscope.json"}
+        return JSONResponse(sampler.to_speedscope(), headers=headers)
+    return PlainTextResponse(sampler.to_collapsed())
+
+
+class HttpMetricsMiddleware:
+    """An ASGI middleware which times the requests by the route path, e.g. /api/workers/{pk}"""
+
+    def __init__(self, app):
+        self.app = app
+        self._paths: Dict[object, str] = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        started_at = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = self._route_path(scope)
+            HTTP_DURATION.labels(scope["method"], route, status[0]).observe(time.perf_counter() - started_at)
+
+    def _route_path(self, scope) -> str:
+        endpoint = scope.get("endpoint")  # the router puts the matched endpoint into the scope
+        if endpoint is None:
+            return "unmatched"
+        if endpoint not in self._paths:
+            router = scope.get("router")
+            paths = {getattr(r, "endpoint", None): r.path for r in getattr(router, "routes", [])}
+            self._paths[endpoint] = paths.get(endpoint, getattr(endpoint, "__name__", type(endpoint).__name__))
+        return self._paths[endpoint]
+
+
+class ProfilerMiddleware:
+    """?profile=collapsed or ?profile=speedscope samples the threads while the request is handled and returns
+    the profile instead of the response. It needs the access token, as the api routes do."""
+
+    def __init__(self, app, access_token: str, api_key_name: str, interval: float = 0.005):
+        self.app = app
+        self.access_token = access_token
+        self.api_key_name = api_key_name
+        self.interval = interval
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or b"profile=" not in scope.get("query_string", b""):
+            return await self.app(scope, receive, send)
+        request = Request(scope)
+        profile_format = request.query_params.get("profile")
+        if profile_format not in ProfileFormat.__members__ or not self._is_authorized(request):
+            return await self.app(scope, receive, send)
+
+        async def discard(_message):
+            pass
+
+        try:
+            sampler = Sampler(self.interval).start()
+        except UserError as e:
+            return await PlainTextResponse(str(e), status_code=429)(scope, receive, send)
+        try:
+            await self.app(scope, receive, discard)
+        finally:
+            sampler.stop()
+        await profile_response(sampler, ProfileFormat(profile_format))(scope, receive, send)
+
+    def _is_authorized(self, request: Request) -> bool:
+        keys = [request.query_params, request.headers, request.cookies]
+        return any(key.get(self.api_key_name) == self.access_token for key in keys)
@@ -1,21 +1,63 @@
+from datetime import datetime
 from typing import Optional
 
-from fastapi import APIRouter
+from fastapi import APIRouter, Query
 from mb_commons.mongo import make_query
+from starlette.responses import StreamingResponse
 
 from app.core.core import Core
-from app.core.models import DataStatus
+from app.core.models import DataBucket, DataSortField, DataStatus
+from app.core.services.data_service import MAX_PAGE_SIZE
 
 
 def init(core: Core) -> APIRouter:
     router = APIRouter()
 
     @router.get("")
-    def get_data_list(worker: Optional[str] = None, status: Optional[DataStatus] = None, limit: int = 100):
-        return core.db.data.find(make_query(worker=worker, status=status), "-created_at", limit)
+    async def get_data_list(worker: Optional[str] = None, status: Optional[DataStatus] = None, limit: int = 100):
+        return await core.async_db.data.find(make_query(worker=worker, status=status), "-created_at", limit)
+
+    @router.get("/page")
+    async def get_data_page(
+        worker: Optional[str] = None,
+        status: Optional[DataStatus] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        cursor: Optional[str] = None,
+        limit: int = Query(100, gt=0, le=MAX_PAGE_SIZE),
+    ):
+        items, next_cursor = await core.data_service.find_page_async(worker, status, since, until, cursor, limit)
+        return {"items": items, "next_cursor": next_cursor}
+
+    @router.get("/export")
+    def export_data(
+        worker: Optional[str] = None,
+        status: Optional[DataStatus] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+    ):
+        lines = core.data_service.export(worker, status, since, until)
+        return StreamingResponse(lines, media_type="application/x-ndjson")
+
+    @router.get("/stats")
+    def get_data_stats(
+        worker: Optional[str] = None,
+        bucket: DataBucket = DataBucket.hour,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+    ):
+        return core.data_service.get_stats(worker, bucket, since, until)
+
+    @router.get("/top")
+    def get_top_data(by: DataSortField = DataSortField.duration, since: Optional[datetime] = None, limit: int = 100):
+        return core.data_service.find_top(by, since, limit)
+
+    @router.get("/slowest-workers")
+    def get_slowest_workers(since: Optional[datetime] = None, limit: int = 20):
+        return core.data_service.find_slowest_workers(since, limit)
 
     @router.get("/{pk}")
-    def get_data(pk):
-        return core.db.data.get_or_none(pk)
+    async def get_data(pk):
+        return await core.async_db.data.get_or_none(pk)
 
     return router
@@ -1,10 +1,16 @@
+import asyncio
 import tracemalloc
+from typing import Optional
 
-from fastapi import APIRouter
-from starlette.responses import PlainTextResponse
+from fastapi import APIRouter, Query
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse, StreamingResponse
 
 from app.core.core import Core
-from app.core.models import BotUpdate
+from app.core.errors import UserError
+from app.core.models import BotUpdate, ProfileFormat, SnapshotKey
+from app.core.profiler import MAX_SECONDS, MIN_INTERVAL, Sampler
+from app.server.middleware import profile_response
 
 
 def init(core: Core) -> APIRouter:
@@ -12,7 +18,16 @@ def init(core: Core) -> APIRouter:
 
     @router.get("")
     def system_stats():
-        return core.system_service.get_stats()
+        return {
+            **core.system_service.get_stats(),
+            "circuit_breakers": core.worker_service.circuit_breaker.get_stats(),
+            "telegram_sender": core.system_service.telegram_sender.get_stats(),
+        }
+
+    @router.get("/dispatcher")
+    def dispatcher_stats():
+        write_buffer = core.worker_service.write_buffer.get_stats()
+        return {**core.worker_service.get_dispatch_stats(), "write_buffer": write_buffer}
 
     @router.get("/bot")
     def get_bot():
@@ -31,17 +46,48 @@ def init(core: Core) -> APIRouter:
         return core.system_service.stop_bot()
 
     @router.get("/log", response_class=PlainTextResponse)
-    def view_logfile():
-        return core.system_service.read_logfile()
+    def view_logfile(
+        tail: Optional[int] = None,
+        offset: int = 0,
+        length: Optional[int] = None,
+        level: Optional[str] = None,
+        contains: Optional[str] = None,
+    ):
+        lines = core.system_service.read_logfile(tail, offset, length, level, contains)
+        return StreamingResponse(lines, media_type="text/plain")
+
+    @router.get("/log/follow")
+    async def follow_logfile(request: Request, level: Optional[str] = None, contains: Optional[str] = None):
+        """New log lines as server-sent events, until the client disconnects"""
+        lines = core.system_service.follow_logfile(level, contains, request.is_disconnected)
+        return StreamingResponse((f"data: {line}\n\n" async for line in lines), media_type="text/event-stream")
 
     @router.delete("/log")
     def clean_logfile():
         core.system_service.clean_logfile()
         return True
 
+    @router.get("/profile")
+    async def profile_cpu(
+        seconds: float = 10,
+        interval: float = 0.01,
+        skip_idle: bool = False,
+        format_: ProfileFormat = Query(ProfileFormat.collapsed, alias="format"),
+    ):
+        """Sample the stacks of all the threads for N seconds. skip_idle drops the samples of the waiting threads."""
+        if not 0 < seconds <= MAX_SECONDS or interval < MIN_INTERVAL:
+            raise UserError(f"seconds must be in (0, {MAX_SECONDS}] and interval must be at least {MIN_INTERVAL}")
+        sampler = Sampler(interval, skip_idle).start()
+        try:
+            await asyncio.sleep(seconds)  # the sampler has its own thread, the event loop is free meanwhile
+        finally:
+            sampler.stop()  # the request can be cancelled by a client disconnect
+        return profile_response(sampler, format_)
+
     @router.post("/tracemalloc/start")
-    def start_tracemalloc():
-        tracemalloc.start()
+    def start_tracemalloc(frames: int = 1):
+        """frames > 1 is needed for the traceback grouping and to see library allocations made by the app code"""
+        tracemalloc.start(frames)
         return {"message": "tracemalloc was started"}
 
     @router.post("/tracemalloc/stop")
@@ -53,7 +99,35 @@ def init(core: Core) -> APIRouter:
     def snapshot_tracemalloc():
         return core.system_service.tracemalloc_snapshot()
 
-    from typing import Optional
+    @router.get("/tracemalloc/snapshots")
+    def get_tracemalloc_snapshots():
+        return core.system_service.memory_snapshots.list()
+
+    @router.post("/tracemalloc/snapshots")
+    def take_tracemalloc_snapshot(name: Optional[str] = None, own_only: bool = True):
+        return core.system_service.memory_snapshots.take(name, own_only)
+
+    @router.post("/tracemalloc/auto")
+    def auto_tracemalloc_snapshots(interval: int):
+        """Take a snapshot every `interval` seconds, 0 stops it"""
+        if interval > 0:
+            core.system_service.memory_snapshots.start_auto(interval)
+        else:
+            core.system_service.memory_snapshots.stop_auto()
+        return True
+
+    @router.get("/tracemalloc/compare", response_class=PlainTextResponse)
+    def compare_tracemalloc_snapshots(old: str, new: str, key: SnapshotKey = SnapshotKey.lineno, limit: int = 30):
+        return core.system_service.memory_snapshots.compare(old, new, key.value, limit)
+
+    @router.get("/tracemalloc/snapshots/{name}", response_class=PlainTextResponse)
+    def get_tracemalloc_snapshot(name: str, key: SnapshotKey = SnapshotKey.lineno, limit: int = 30):
+        return core.system_service.memory_snapshots.top(name, key.value, limit)
+
+    @router.delete("/tracemalloc/snapshots/{name}")
+    def delete_tracemalloc_snapshot(name: str):
+        core.system_service.memory_snapshots.delete(name)
+        return True
 
     @router.post("/test-telegram-message")
     def test_telegram_message(large: Optional[bool] = None):
@@ -41,10 +41,10 @@ def init(core: Core, templates: Jinja2Templates) -> APIRouter:
         return templates.TemplateResponse("index.j2", md(request))
 
     @router.get("/workers", response_class=HTMLResponse)
-    def workers_page(request: Request):
+    async def workers_page(request: Request):
         form = WorkersFilterForm(request.query_params)
         query = make_query(started=form.data["started"], name=form.data["name"])
-        workers = core.db.worker.find(query, "-created_at", form.data["limit"])
+        workers = await core.async_db.worker.find(query, "-created_at", form.data["limit"])
         return templates.TemplateResponse("workers.j2", md(request, form, workers))
 
     @router.get("/create-worker")
@@ -53,10 +53,10 @@ def init(core: Core, templates: Jinja2Templates) -> APIRouter:
         return templates.TemplateResponse("create_worker.j2", md(request, form))
 
     @router.get("/data", response_class=HTMLResponse)
-    def data_page(request: Request):
+    async def data_page(request: Request):
         form = DataFilterForm(request.query_params)
         query = make_query(worker=form.data["worker"], status=form.data["status"])
-        data = core.db.data.find(query, "-created_at", form.data["limit"])
+        data = await core.async_db.data.find(query, "-created_at", form.data["limit"])
         return templates.TemplateResponse("data.j2", md(request, form, data))
 
     @router.post("/create-worker")
@@ -1,30 +1,31 @@
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 from fastapi import APIRouter
 from mb_commons.mongo import make_query
+from pydantic import PositiveInt
 
 from app.core.core import Core
-from app.core.models import Worker, WorkerCreate
+from app.core.models import DataStatus, Worker, WorkerCreate
 
 
 def init(core: Core) -> APIRouter:
     router = APIRouter()
 
     @router.get("", response_model=List[Worker])
-    def get_workers(started: Optional[bool] = None, limit: int = 100):
-        return core.db.worker.find(make_query(started=started), "-created_at", limit)
+    async def get_workers(started: Optional[bool] = None, limit: int = 100):
+        return await core.async_db.worker.find(make_query(started=started), "-created_at", limit)
 
     @router.post("", response_model=Worker)
     def create_worker(worker: WorkerCreate):
         return core.worker_service.create(worker)
 
     @router.get("/{pk}", response_model=Optional[Worker])
-    def get_worker(pk):
-        return core.db.worker.get_or_none(pk)
+    async def get_worker(pk):
+        return await core.async_db.worker.get_or_none(pk)
 
     @router.delete("/{pk}")
     def delete_worker(pk):
-        return core.db.worker.delete_by_id(pk)
+        return core.worker_service.delete_worker(pk)
 
     @router.post("/{pk}/start")
     def start_worker(pk):
@@ -34,6 +35,10 @@ def init(core: Core) -> APIRouter:
     def stop_worker(pk):
         return core.worker_service.stop_worker(pk)
 
+    @router.put("/{pk}/retention", response_model=Optional[Worker])
+    def update_worker_retention(pk, retention: Dict[DataStatus, PositiveInt]):
+        return core.worker_service.update_retention(pk, retention)
+
     @router.post("/{pk}/work")
     def process_worker_work(pk):
         return core.worker_service.work(pk)
@@ -7,14 +7,16 @@ from fastapi.openapi.docs import get_swagger_ui_html
 from fastapi.openapi.models import APIKey
 from fastapi.openapi.utils import get_openapi
 from fastapi.security import APIKeyCookie, APIKeyHeader, APIKeyQuery
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from starlette.requests import Request
-from starlette.responses import JSONResponse, PlainTextResponse, RedirectResponse
+from starlette.responses import JSONResponse, PlainTextResponse, RedirectResponse, Response
 from starlette.staticfiles import StaticFiles
 from starlette.status import HTTP_403_FORBIDDEN
 
 from app.core.core import Core
 from app.core.errors import UserError
 from app.server.jinja import configure_jinja
+from app.server.middleware import HttpMetricsMiddleware, ProfilerMiddleware
 from app.server.routers import data_router, system_router, telegram_router, ui_router, worker_router
 from app.telegram import Telegram
 
@@ -37,6 +39,12 @@ class Server:
             openapi_tags=core.config.tags_metadata,
         )
         self.templates = configure_jinja(core)
+        self.app.add_middleware(HttpMetricsMiddleware)
+        self.app.add_middleware(
+            ProfilerMiddleware,
+            access_token=core.config.access_token,
+            api_key_name=self.api_key_name,
+        )
         self._configure_app()
         self._configure_openapi()
         self._configure_routers()
@@ -142,6 +150,10 @@ class Server:
         async def redirect_to_api():
             return RedirectResponse(url="/ui")
 
+        @self.app.get("/metrics", tags=["system"], dependencies=[Depends(self._get_api_key())])
+        def metrics():
+            return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
     def _get_api_key(self) -> Callable:
         async def _get_api_key(
             query: str = Server.key_query,
@@ -85,7 +85,7 @@ class Telegram:
         @auth(admins=self.core.system_service.get_bot().telegram_admins, bot=self.bot)
         def workers_handler(message: Message):
             result = ""
-            for w in self.core.db.worker.find({}, "name"):
+            for w in sorted(self.core.worker_service.registry.all(), key=lambda worker: worker.name):
                 result += f"{w.name}, source={w.source}, started={w.started}\n"
             self._send_message(message.chat.id, result)
 
@@ -97,7 +97,7 @@ class Telegram:
             if not worker_name:
                 return self._send_message(chat_id, "usage: /start_worker ${worker_name}")
 
-            worker = self.core.db.worker.find_one({"name": worker_name})
+            worker = self.core.worker_service.registry.get_by_name(worker_name)
             if worker:
                 self.core.worker_service.start_worker(worker.id)
                 return self._send_message(chat_id, "worker was started")
@@ -112,7 +112,7 @@ class Telegram:
             if not worker_name:
                 return self._send_message(chat_id, "usage: /stop_worker ${worker_name}")
 
-            worker = self.core.db.worker.find_one({"name": worker_name})
+            worker = self.core.worker_service.registry.get_by_name(worker_name)
             if worker:
                 self.core.worker_service.stop_worker(worker.id)
                 return self._send_message(chat_id, "worker was stopped")
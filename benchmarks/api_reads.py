@@ -0,0 +1,77 @@
+"""Compare a sync route on DB with an async route on AsyncDB under concurrent load.
+
+Both routes read the latest data records, as GET /api/data does. It needs a running mongo with some data.
+
+usage: python -m benchmarks.api_reads <database_url> [requests] [concurrency] [limit]
+"""
+import asyncio
+import sys
+import threading
+import time
+
+import aiohttp
+import uvicorn
+from fastapi import FastAPI
+
+from app.core.async_db import AsyncDB
+from app.core.db import DB
+
+PORT = 8799
+
+
+def make_app(database_url: str, limit: int) -> FastAPI:
+    app = FastAPI()
+    db = DB(database_url)
+    async_db = AsyncDB(database_url)
+
+    @app.get("/sync")
+    def sync_route():
+        return db.data.find({}, "-created_at", limit)
+
+    @app.get("/async")
+    async def async_route():
+        return await async_db.data.find({}, "-created_at", limit)
+
+    return app
+
+
+async def load(url: str, requests: int, concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+
+        async def one():
+            async with semaphore:
+                async with session.get(url) as resp:
+                    await resp.read()
+
+        await one()  # warm up the connections
+        started_at = time.perf_counter()
+        await asyncio.gather(*[one() for _ in range(requests)])
+        return time.perf_counter() - started_at
+
+
+def main():
+    database_url = sys.argv[1]
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    concurrency = int(sys.argv[3]) if len(sys.argv) > 3 else 100
+    limit = int(sys.argv[4]) if len(sys.argv) > 4 else 100
+
+    server = uvicorn.Server(uvicorn.Config(make_app(database_url, limit), port=PORT, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.1)
+
+    for route in ["sync", "async"]:
+        threads_before = threading.active_count()
+        elapsed = asyncio.run(load(f"http://127.0.0.1:{PORT}/{route}", requests, concurrency))
+        threads = threading.active_count() - threads_before
+        print(  # noqa: T001
+            f"{route:6} {requests} requests in {elapsed:.2f}s, {requests / elapsed:.0f} req/s, +{threads} threads",
+        )
+
+    server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
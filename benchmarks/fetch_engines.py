@@ -0,0 +1,72 @@
+"""Compare the threads and asyncio fetch engines against a local stub HTTP server.
+
+usage: python -m benchmarks.fetch_engines [fetches] [worker_limit] [delay_ms]
+"""
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from mb_commons import ParallelTasks
+
+from app.core.fetcher import AsyncFetcher, thread_fetch
+
+BODY = json.dumps({"items": list(range(100))}).encode()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    delay = 0.0
+
+    def do_GET(self):  # noqa: N802
+        time.sleep(self.delay)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+def bench_threads(url: str, fetches: int, worker_limit: int) -> float:
+    started_at = time.perf_counter()
+    for _ in range(0, fetches, worker_limit):
+        tasks = ParallelTasks(max_workers=worker_limit)
+        for i in range(worker_limit):
+            tasks.add_task(f"fetch_{i}", thread_fetch, args=(url, 10))
+        tasks.execute()
+    return time.perf_counter() - started_at
+
+
+def bench_asyncio(url: str, fetches: int, worker_limit: int) -> float:
+    fetcher = AsyncFetcher(limit=worker_limit, limit_per_host=worker_limit)
+    fetcher.fetch(url, 10)  # warm up the pool, as it happens in a long running process
+    started_at = time.perf_counter()
+    for _ in range(0, fetches, worker_limit):
+        fetcher.fetch_many([url] * worker_limit, 10)
+    elapsed = time.perf_counter() - started_at
+    fetcher.close()
+    return elapsed
+
+
+def main():
+    fetches = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    worker_limit = int(sys.argv[2]) if len(sys.argv) > 2 else 15
+    StubHandler.delay = (int(sys.argv[3]) if len(sys.argv) > 3 else 5) / 1000
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/data.json"
+
+    for name, bench in [("threads", bench_threads), ("asyncio", bench_asyncio)]:
+        elapsed = bench(url, fetches, worker_limit)
+        print(f"{name:8} {fetches} fetches in {elapsed:.2f}s, {fetches / elapsed:.0f} fetches/s")  # noqa: T001
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
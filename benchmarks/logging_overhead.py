@@ -0,0 +1,68 @@
+"""Measure the cost of a log call in the fetch threads: handlers called directly vs the queue pipeline.
+
+Every thread logs `per_fetch` info records per simulated fetch, the time is the caller side only.
+
+usage: python -m benchmarks.logging_overhead [fetches] [threads] [per_fetch]
+"""
+import logging
+import queue
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from logging.handlers import QueueListener, RotatingFileHandler
+
+from app.core.logs import RecordQueueHandler, make_formatter
+
+
+def make_file_handler(log_dir: str, json_format: bool) -> logging.Handler:
+    handler = RotatingFileHandler(f"{log_dir}/app.log", maxBytes=10 * 1024 * 1024, backupCount=1)
+    handler.setFormatter(make_formatter(json_format))
+    return handler
+
+
+def bench(log: logging.Logger, fetches: int, threads: int, per_fetch: int) -> float:
+    def fetch(i: int):
+        for j in range(per_fetch):
+            log.info("work(%s): status=%s, step %d", i, "ok", j)
+
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        list(executor.map(fetch, range(fetches)))
+    return time.perf_counter() - started_at
+
+
+def main():
+    fetches = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 15
+    per_fetch = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+
+    for mode in ["direct", "queue", "queue+json"]:
+        with tempfile.TemporaryDirectory() as log_dir:
+            log = logging.getLogger(f"bench_{mode}")
+            log.setLevel(logging.INFO)
+            log.propagate = False
+            file_handler = make_file_handler(log_dir, json_format=mode == "queue+json")
+            listener = None
+            if mode == "direct":
+                log.addHandler(file_handler)
+            else:
+                log_queue: queue.SimpleQueue = queue.SimpleQueue()
+                log.addHandler(RecordQueueHandler(log_queue))
+                listener = QueueListener(log_queue, file_handler)
+                listener.start()
+
+            elapsed = bench(log, fetches, threads, per_fetch)
+            if listener:
+                drain_started_at = time.perf_counter()
+                listener.stop()
+                drain = f", the writer thread drained the queue in {time.perf_counter() - drain_started_at:.2f}s"
+            else:
+                drain = ""
+            file_handler.close()
+            per_fetch_us = elapsed / fetches * 1_000_000
+            print(f"{mode:10} {per_fetch_us:.1f}us of logging per fetch{drain}")  # noqa: T001
+
+
+if __name__ == "__main__":
+    main()
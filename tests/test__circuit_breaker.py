@@ -0,0 +1,35 @@
+from app.core.circuit_breaker import CircuitBreaker
+
+
+def test_opens_after_threshold_and_closes_after_probe():
+    breaker = CircuitBreaker()
+    for _ in range(3):
+        assert breaker.allow("a.com", threshold=3, cooldown=60)
+        breaker.record("a.com", success=False, threshold=3)
+
+    assert not breaker.allow("a.com", threshold=3, cooldown=60)
+    assert breaker.allow("b.com", threshold=3, cooldown=60)
+    assert breaker.get_stats()["a.com"]["state"] == "open"
+
+    # the cooldown is over: one probe goes, the next calls wait for its result
+    assert breaker.allow("a.com", threshold=3, cooldown=0)
+    assert not breaker.allow("a.com", threshold=3, cooldown=60)
+
+    breaker.record("a.com", success=True, threshold=3)
+    assert breaker.allow("a.com", threshold=3, cooldown=60)
+    assert breaker.get_stats() == {}
+
+
+def test_failed_probe_opens_again():
+    breaker = CircuitBreaker()
+    breaker.record("a.com", success=False, threshold=1)
+    assert breaker.allow("a.com", threshold=1, cooldown=0)
+    breaker.record("a.com", success=False, threshold=1)
+    assert not breaker.allow("a.com", threshold=1, cooldown=60)
+
+
+def test_zero_threshold_is_off():
+    breaker = CircuitBreaker()
+    for _ in range(10):
+        breaker.record("a.com", success=False, threshold=0)
+    assert breaker.allow("a.com", threshold=0, cooldown=60)
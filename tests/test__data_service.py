@@ -0,0 +1,152 @@
+import base64
+import json
+import logging
+import math
+from datetime import timedelta
+from types import SimpleNamespace
+
+import pytest
+from bson import ObjectId
+from mb_commons import utc_now
+
+from app.core.errors import UserError
+from app.core.models import Data, DataStatus
+from app.core.services.data_service import (
+    BINS_PER_DECADE,
+    DataService,
+    decode_cursor,
+    encode_cursor,
+    histogram_percentile,
+)
+
+
+class FakeCursor(list):
+    def limit(self, n: int):
+        return self[:n]
+
+
+class FakeCollection:
+    """The subset of the queries the compaction makes: equality, $lt, $in, $nin, $ne and $or. aggregate() returns
+    `groups`, the grouping itself is the database's job."""
+
+    def __init__(self, docs=()):
+        self.docs = {doc["_id"]: doc for doc in docs}
+        self.groups: list = []
+
+    def find(self, query, _projection=None):
+        return FakeCursor(doc for doc in self.docs.values() if _matches(doc, query))
+
+    def delete_many(self, query):
+        ids = [doc["_id"] for doc in self.docs.values() if _matches(doc, query)]
+        for pk in ids:
+            del self.docs[pk]
+        return SimpleNamespace(deleted_count=len(ids))
+
+    def aggregate(self, _pipeline, **_kwargs):
+        return self.groups
+
+    def update_one(self, query, update):
+        for doc in self.docs.values():
+            if _matches(doc, query):
+                doc.update(update.get("$set", {}))
+                for field, value in update.get("$inc", {}).items():
+                    doc[field] = doc.get(field, 0) + value
+                return doc
+
+    def find_one_and_update(self, query, update, **_kwargs):
+        return self.update_one(query, update)
+
+    def bulk_write(self, requests, **_kwargs):
+        for request in requests:
+            self.update_one(request._filter, request._doc)
+
+
+def _matches(doc: dict, query: dict) -> bool:
+    conditions = {"$lt": lambda v, x: v is not None and v < x, "$in": lambda v, x: v in x}
+    conditions.update({"$nin": lambda v, x: v not in x, "$ne": lambda v, x: v != x})
+    for key, cond in query.items():
+        value = doc.get(key)
+        if key == "$or":
+            if not any(_matches(doc, alternative) for alternative in cond):
+                return False
+        elif isinstance(cond, dict):
+            if not all(conditions[op](value, arg) for op, arg in cond.items()):
+                return False
+        elif value != cond:
+            return False
+    return True
+
+
+def make_data_service(data_docs, worker_docs, bot) -> DataService:
+    db = SimpleNamespace(
+        data=SimpleNamespace(collection=FakeCollection(data_docs)),
+        worker=SimpleNamespace(collection=FakeCollection(worker_docs), find=lambda query: []),
+        bot=SimpleNamespace(collection=FakeCollection([{"_id": 1}])),
+    )
+    system_service = SimpleNamespace(get_bot=lambda: bot)
+    config = SimpleNamespace(data_compaction_interval=3600)
+    return DataService(config, logging.getLogger("test"), db, None, system_service)
+
+
+def test_cursor_round_trip():
+    data = Data(**{"_id": ObjectId(), "worker": "w1", "status": DataStatus.ok, "data": None})
+    assert decode_cursor(encode_cursor(data)) == (data.created_at, ObjectId(data.id))
+
+
+def test_invalid_cursor():
+    not_a_pair = base64.urlsafe_b64encode(json.dumps(["2021-01-01T00:00:00"]).encode()).decode()
+    bad_id = base64.urlsafe_b64encode(json.dumps(["2021-01-01T00:00:00", "123"]).encode()).decode()
+    for cursor in ["", "not-base64!", not_a_pair, bad_id]:
+        with pytest.raises(UserError):
+            decode_cursor(cursor)
+
+
+def test_histogram_percentile():
+    assert histogram_percentile({}, 50) is None
+    durations = [0.1] * 50 + [0.5] * 40 + [3.0] * 10
+    bins: dict = {}
+    for d in durations:
+        value_bin = math.floor(math.log10(d) * BINS_PER_DECADE)
+        bins[value_bin] = bins.get(value_bin, 0) + 1
+    for p, expected in [(50, 0.1), (90, 0.5), (99, 3.0), (100, 3.0)]:
+        assert abs(histogram_percentile(bins, p) - expected) / expected < 0.06  # within half a bin
+
+
+def test_compaction_keeps_the_records_of_dedup():
+    old = utc_now() - timedelta(days=10)
+    payload, repeat, other = ObjectId(), ObjectId(), ObjectId()
+    data_docs = [
+        {"_id": pk, "worker": "w1", "status": "ok", "created_at": old + timedelta(minutes=i)}
+        for i, pk in enumerate([payload, repeat, other])
+    ]
+    worker_docs = [{"_id": ObjectId(), "name": "w1", "last_data_id": str(payload)}]
+    bot = SimpleNamespace(data_retention={"ok": 1}, downsample_after=0)
+    service = make_data_service(data_docs, worker_docs, bot)
+    keep = service._referenced_ids()
+
+    assert service._delete_expired(keep) == {"w1": 2}
+    assert list(service.db.data.collection.docs) == [payload]  # the payload outlives its retention
+
+    bot = SimpleNamespace(data_retention={}, downsample_after=1)
+    service = make_data_service(data_docs, worker_docs, bot)
+    groups = [{"_id": {"worker": "w1"}, "ids": [other, repeat, payload]}]  # the latest sample of the hour first
+    service.db.data.collection.groups = groups
+    assert service._downsample(None, keep) == {"w1": 1}
+    assert set(service.db.data.collection.docs) == {payload, other}
+
+
+def test_compaction_decreases_data_count():
+    old = utc_now() - timedelta(days=10)
+    data_docs = [{"_id": ObjectId(), "worker": w, "status": "error", "created_at": old} for w in ["w1", "w1", "w2"]]
+    data_docs.append({"_id": ObjectId(), "worker": "w1", "status": "ok", "created_at": old})
+    worker_docs = [
+        {"_id": ObjectId(), "name": "w1", "data_count": 3},
+        {"_id": ObjectId(), "name": "w2", "data_count": 1},
+    ]
+    service = make_data_service(
+        data_docs, worker_docs, SimpleNamespace(data_retention={"error": 1}, downsample_after=0)
+    )
+    service._recounted = True  # no backfill, it's the counters from now on
+    service.compact()
+    assert [w["data_count"] for w in service.db.worker.collection.docs.values()] == [1, 0]
+    assert service.db.bot.collection.docs[1]["compaction_owner"] is None  # the lease is released
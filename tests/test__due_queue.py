@@ -0,0 +1,40 @@
+from app.core.due_queue import DueQueue
+
+
+def test_pop_due_in_deadline_order():
+    queue = DueQueue()
+    queue.push("w1", 30)
+    queue.push("w2", 10)
+    queue.push("w3", 20)
+    queue.push("w4", 100)
+
+    assert queue.next_due() == 10
+    assert queue.count_due(now=50) == 3
+    assert queue.pop_due(limit=2, now=50) == [("w2", 10), ("w3", 20)]
+    assert queue.pop_due(limit=10, now=50) == [("w1", 30)]
+    assert queue.pop_due(limit=10, now=50) == []
+    assert queue.next_due() == 100
+
+
+def test_push_overrides_previous_deadline():
+    queue = DueQueue()
+    queue.push("w1", 10)
+    queue.push("w1", 60)
+
+    assert queue.pop_due(limit=10, now=50) == []
+    assert queue.pop_due(limit=10, now=60) == [("w1", 60)]
+
+
+def test_reschedule_after_remove_is_noop():
+    queue = DueQueue()
+    queue.push("w1", 10)
+    queue.push("w2", 10)
+    assert queue.pop_due(limit=10, now=10) == [("w1", 10), ("w2", 10)]
+    assert len(queue) == 0
+
+    queue.remove("w1")  # stopped while working
+    queue.reschedule("w1", 20)
+    queue.reschedule("w2", 20)
+
+    assert "w1" not in queue
+    assert queue.pop_due(limit=10, now=20) == [("w2", 20)]
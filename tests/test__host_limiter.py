@@ -0,0 +1,40 @@
+from app.core.host_limiter import SLOT_WAIT, HostLimiter
+
+
+def test_concurrency_limit():
+    limiter = HostLimiter()
+    assert limiter.acquire("a.com", rps=0, concurrency=2) == 0
+    assert limiter.acquire("a.com", rps=0, concurrency=2) == 0
+    assert limiter.acquire("a.com", rps=0, concurrency=2) == SLOT_WAIT
+    assert limiter.acquire("b.com", rps=0, concurrency=2) == 0  # another host has its own slots
+
+    limiter.release("a.com")
+    assert limiter.acquire("a.com", rps=0, concurrency=2) == 0
+    assert limiter.get_stats() == {"a.com": 2, "b.com": 1}
+
+
+def test_waiters_are_woken_on_release():
+    limiter = HostLimiter()
+    assert limiter.acquire("a.com", rps=0, concurrency=1, waiter="w1") == 0
+    assert limiter.acquire("a.com", rps=0, concurrency=1, waiter="w2") == SLOT_WAIT
+    assert limiter.acquire("a.com", rps=0, concurrency=1, waiter="w3") == SLOT_WAIT
+    assert limiter.acquire("a.com", rps=0, concurrency=1, waiter="w2") == SLOT_WAIT  # it's queued once
+
+    assert limiter.release("a.com") == "w2"
+    assert limiter.acquire("a.com", rps=0, concurrency=1, waiter="w2") == 0
+    assert limiter.release("a.com") == "w3"
+    assert limiter.release("a.com") is None
+
+
+def test_rate_limit():
+    limiter = HostLimiter()
+    assert limiter.acquire("a.com", rps=2, concurrency=0) == 0
+    assert limiter.acquire("a.com", rps=2, concurrency=0) == 0
+    wait = limiter.acquire("a.com", rps=2, concurrency=0)
+    assert 0 < wait <= 0.5
+
+
+def test_no_limits():
+    limiter = HostLimiter()
+    for _ in range(100):
+        assert limiter.acquire("a.com", rps=0, concurrency=0) == 0
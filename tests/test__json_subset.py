@@ -0,0 +1,19 @@
+from app.core.json_subset import pick
+
+
+def test_pick_fields():
+    value = {"price": 1.5, "volume": 100, "meta": {"source": "x", "ts": 1}, "items": [{"id": 1, "v": 2}, {"id": 2}]}
+    expected = {"price": 1.5, "meta": {"ts": 1}, "items": [{"id": 1}, {"id": 2}]}
+    assert pick(value, ["price", "meta.ts", "items.id"]) == expected
+    assert pick(value, ["meta", "meta.ts"]) == {"meta": {"source": "x", "ts": 1}}  # a parent path keeps it all
+
+
+def test_pick_missing_paths():
+    assert pick({"a": 1}, ["b", "a.c"]) == {}
+    assert pick([{"a": 1}, 2, {"b": 3}], ["a"]) == [{"a": 1}, {}]
+    assert pick(5, ["a"]) is None
+
+
+def test_pick_no_paths():
+    value = {"a": 1}
+    assert pick(value, []) is value
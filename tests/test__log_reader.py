@@ -0,0 +1,68 @@
+import asyncio
+
+from app.core import log_reader
+
+LINES = [f"2021-01-01 00:00:{i:02} - app - {'ERROR' if i % 10 == 0 else 'INFO'} - message {i}\n" for i in range(50)]
+
+
+def test_tail(tmp_path, monkeypatch):
+    monkeypatch.setattr(log_reader, "CHUNK_SIZE", 100)  # many chunks, lines cross their boundaries
+    path = tmp_path / "app.log"
+    path.write_text("".join(LINES))
+
+    assert log_reader.tail(str(path), 3) == LINES[-3:]
+    assert log_reader.tail(str(path), 100) == LINES
+    assert log_reader.tail(str(path), 2, log_reader.make_filter(level="error")) == [LINES[30], LINES[40]]
+    assert log_reader.tail(str(path), 5, log_reader.make_filter(contains="message 4")) == LINES[45:]
+
+
+def test_read_range(tmp_path, monkeypatch):
+    monkeypatch.setattr(log_reader, "CHUNK_SIZE", 100)
+    path = tmp_path / "app.log"
+    path.write_text("".join(LINES))
+    offset = len(LINES[0])
+
+    assert "".join(log_reader.read_range(str(path))) == "".join(LINES)
+    assert "".join(log_reader.read_range(str(path), offset, len(LINES[1]))) == LINES[1]
+    assert list(log_reader.read_range(str(path), offset, line_filter=log_reader.make_filter(level="ERROR"))) == [
+        LINES[10],
+        LINES[20],
+        LINES[30],
+        LINES[40],
+    ]
+
+
+def test_follow(tmp_path):
+    path = tmp_path / "app.log"
+    path.write_text(LINES[0])
+
+    async def read_new_lines():
+        lines = log_reader.follow(str(path), poll_interval=0.01)
+        with open(path, "a") as f:
+            f.write(LINES[1] + LINES[2][:10])
+        first = await lines.__anext__()
+        with open(path, "a") as f:
+            f.write(LINES[2][10:])
+        second = await lines.__anext__()
+        path.write_text(LINES[3])  # the file is rotated
+        third = await lines.__anext__()
+        return [first, second, third]
+
+    result = asyncio.run(asyncio.wait_for(read_new_lines(), 5))
+    assert result == [line.rstrip("\n") for line in LINES[1:4]]
+
+
+def test_follow_stops_on_disconnect(tmp_path):
+    path = tmp_path / "app.log"
+    path.write_text(LINES[0])
+    checks = []
+
+    async def is_disconnected() -> bool:
+        checks.append(True)
+        return len(checks) > 2
+
+    async def read_all():
+        return [line async for line in log_reader.follow(str(path), None, 0.01, is_disconnected)]
+
+    assert asyncio.run(asyncio.wait_for(read_all(), 5)) == []
+    assert len(checks) == 3
@@ -0,0 +1,37 @@
+import json
+import logging
+import queue
+from logging.handlers import QueueListener
+
+from app.core.logs import RecordQueueHandler, make_formatter
+
+
+def test_queue_pipeline_json(tmp_path):
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    file_handler = logging.FileHandler(tmp_path / "app.log")
+    file_handler.setFormatter(make_formatter(json_format=True))
+    listener = QueueListener(log_queue, file_handler)
+    listener.start()
+
+    log = logging.getLogger("test__logs")
+    log.propagate = False
+    log.addHandler(RecordQueueHandler(log_queue))
+    log.warning("worker %s failed", "w1")
+    try:
+        raise ValueError("bad")
+    except ValueError:
+        log.exception("oops")
+    listener.stop()
+    file_handler.close()
+
+    first, second = [json.loads(line) for line in (tmp_path / "app.log").read_text().splitlines()]
+    assert first["level"] == "WARNING" and first["message"] == "worker w1 failed" and "exc" not in first
+    assert second["message"] == "oops" and "ValueError: bad" in second["exc"]
+
+
+def test_text_format_keeps_traceback():
+    record = logging.LogRecord("app", logging.ERROR, __file__, 1, "oops %d", (1,), None)
+    record.exc_text = "Traceback: ..."
+    handler = RecordQueueHandler(queue.SimpleQueue())
+    line = make_formatter(json_format=False).format(handler.prepare(record))
+    assert " - app - ERROR - oops 1\nTraceback: ..." in line
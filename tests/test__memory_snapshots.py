@@ -0,0 +1,72 @@
+import logging
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.core import memory_snapshots
+from app.core.errors import UserError
+from app.core.memory_snapshots import SnapshotStore
+
+
+def test_snapshots(monkeypatch):
+    monkeypatch.setattr(memory_snapshots, "APP_DIR", __file__.rsplit("/", 2)[0])  # the tests count as own frames
+    store = SnapshotStore(limit=2, log=logging.getLogger("test"))
+    with pytest.raises(UserError):
+        store.take("before_start")
+
+    tracemalloc.start(5)
+    try:
+        store.take("s1")
+        leak = [bytearray(1000) for _ in range(1000)]  # noqa: F841
+        store.take("s2")
+        growth = store.compare("s1", "s2", "filename")
+        store.take("s3")
+    finally:
+        tracemalloc.stop()
+
+    biggest = growth.splitlines()[0]  # the list of bytearrays made between s1 and s2
+    assert "test__memory_snapshots.py" in biggest and "KiB (+" in biggest
+    assert [s["name"] for s in store.list()] == ["s2", "s3"]  # s1 was dropped over the limit
+    assert store.list()[1]["size"] >= 1_000_000
+    with pytest.raises(UserError):
+        store.compare("s1", "s3")
+
+    assert "test__memory_snapshots.py" in store.top("s3", "traceback")
+    store.delete("s2")
+    assert [s["name"] for s in store.list()] == ["s3"]
+
+
+def test_auto_snapshots(monkeypatch):
+    started_at = datetime(2021, 1, 1)
+    times = (started_at + timedelta(seconds=i) for i in range(100))
+    monkeypatch.setattr(memory_snapshots, "utc_now", lambda: next(times))
+    store = SnapshotStore(limit=2, log=logging.getLogger("test"))
+    store.take_auto()  # no-op while tracemalloc is not tracing
+    tracemalloc.start()
+    try:
+        store.take("baseline")
+        for _ in range(3):
+            store.take_auto()
+    finally:
+        tracemalloc.stop()
+    # the auto snapshots rotate in their own ring and keep the baseline
+    assert [s["name"][:8] for s in store.list()] == ["baseline", "auto-202", "auto-202"]
+
+
+def test_auto_snapshots_survive_errors(monkeypatch, caplog):
+    def fail(*_args, **_kwargs):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(memory_snapshots.tracemalloc, "is_tracing", lambda: True)
+    monkeypatch.setattr(memory_snapshots.tracemalloc, "take_snapshot", fail)
+    store = SnapshotStore(limit=2, log=logging.getLogger("test"))
+    store.start_auto(0.01)
+    try:
+        deadline = time.monotonic() + 5
+        while len([r for r in caplog.records if "boom" in r.message]) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        store.stop_auto()
+    assert len([r for r in caplog.records if "boom" in r.message]) >= 2  # the thread kept going after an error
@@ -0,0 +1,64 @@
+import threading
+import time
+
+import pytest
+
+from app.core.errors import UserError
+from app.core.profiler import MAX_RUNNING, Sampler
+
+
+def busy_loop(stop: threading.Event):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_sampler():
+    stop = threading.Event()
+    threads = [threading.Thread(target=busy_loop, args=(stop,), name=f"busy_{i}") for i in range(2)]
+    for t in threads:
+        t.start()
+    sampler = Sampler(interval=0.005).start()
+    time.sleep(0.2)
+    sampler.stop()
+    stop.set()
+    for t in threads:
+        t.join()
+
+    assert sampler.sample_count > 0
+    busy = [line for line in sampler.to_collapsed().splitlines() if line.startswith("busy;")]
+    frame_name = f"busy_loop (tests/test__profiler.py:{busy_loop.__code__.co_firstlineno})"
+    assert busy and all(frame_name in line for line in busy)
+    assert not any(line.startswith("profiler;") for line in sampler.to_collapsed().splitlines())
+
+    speedscope = sampler.to_speedscope()
+    busy_profile = next(p for p in speedscope["profiles"] if p["name"] == "busy")
+    frames = speedscope["shared"]["frames"]
+    assert all(frames[sample[-1]]["name"].startswith(("busy_loop", "is_set")) for sample in busy_profile["samples"])
+    assert len(busy_profile["samples"]) == len(busy_profile["weights"])
+
+
+def test_skip_idle():
+    stop = threading.Event()
+    waiting = threading.Thread(target=stop.wait, name="waiting")
+    waiting.start()
+    try:
+        idle = Sampler(interval=0.005, skip_idle=True).start()
+        wall = Sampler(interval=0.005).start()
+        time.sleep(0.1)
+        idle.stop()
+        wall.stop()
+    finally:
+        stop.set()
+        waiting.join()
+
+    assert any(line.startswith("waiting;") for line in wall.to_collapsed().splitlines())
+    assert not any(line.startswith("waiting;") for line in idle.to_collapsed().splitlines())
+
+
+def test_running_limit():
+    samplers = [Sampler().start() for _ in range(MAX_RUNNING)]
+    with pytest.raises(UserError):
+        Sampler().start()
+    for sampler in samplers:
+        sampler.stop()
+    Sampler().start().stop()
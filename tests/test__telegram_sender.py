@@ -0,0 +1,38 @@
+import logging
+import threading
+import time
+
+from app.core.telegram_sender import TelegramSender, coalesce
+
+
+class FakeSender(TelegramSender):
+    def __init__(self, limit: int):
+        self.sent = []
+        self.release = threading.Event()
+        super().__init__(logging.getLogger("test"), lambda: None, limit=limit, interval=0)
+
+    def _send(self, text: str) -> bool:
+        self.release.wait()
+        self.sent.append(text)
+        return True
+
+
+def test_coalesce():
+    assert coalesce(["a", "b", "c"]) == ["a\n\nb\n\nc"]
+    assert coalesce(["a" * 6, "b" * 3, "c"], max_length=8) == ["a" * 6, "bbb\n\nc"]
+    assert coalesce(["a" * 10], max_length=4) == ["aaaa", "aaaa", "aa"]
+
+
+def test_overflow_is_dropped_and_reported():
+    sender = FakeSender(limit=2)
+    sender.send("first")  # the sender thread takes it and waits in _send
+    while sender.get_stats()["queued"]:
+        time.sleep(0.01)
+    assert sender.send("m1") and sender.send("m2")
+    assert not sender.send("m3")
+    assert sender.get_stats() == {"sent": 0, "dropped": 1, "errors": 0, "queued": 2}
+
+    sender.release.set()
+    sender.stop()
+    assert sender.sent == ["first", "m1\n\nm2\n\n... 1 messages were dropped, the queue was full"]
+    assert sender.get_stats()["sent"] == 2
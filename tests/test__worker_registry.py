@@ -0,0 +1,43 @@
+from datetime import datetime
+
+from app.core.models import Worker
+from app.core.worker_registry import WorkerRegistry
+
+
+def make_worker(pk: str, name: str, **fields) -> Worker:
+    return Worker(**{"_id": pk, "name": name, "interval": 10, "source": "http://test.com", **fields})
+
+
+def test_registry():
+    registry = WorkerRegistry()
+    registry.put(make_worker("a" * 24, "w1"))
+    registry.put(make_worker("b" * 24, "w2"))
+    assert registry.get_by_name("w1").id == "a" * 24
+    assert len(registry) == 2
+
+    registry.update("a" * 24, {"started": True})
+    assert registry.get("a" * 24).started and registry.get_by_name("w1").started
+
+    registry.put(make_worker("a" * 24, "w1_renamed"))
+    assert registry.get_by_name("w1") is None
+    assert registry.get_by_name("w1_renamed").id == "a" * 24
+
+    registry.remove("b" * 24)
+    assert registry.get_by_name("w2") is None
+    assert len(registry) == 1
+
+
+def test_put_claimed():
+    registry = WorkerRegistry()
+    worked_at = datetime(2021, 1, 1)
+    registry.put(make_worker("a" * 24, "w1", last_work_at=worked_at, etag="v2", content_hash="h2"))
+    # the write buffer hasn't flushed the last result yet, the database has the one before
+    claimed = make_worker("a" * 24, "w1", last_work_at=datetime(2020, 12, 31), etag="v1", lease_owner="me")
+    worker = registry.put_claimed(claimed)
+    assert (worker.etag, worker.content_hash, worker.lease_owner) == ("v2", "h2", "me")
+
+    claimed = make_worker("a" * 24, "w1", last_work_at=datetime(2021, 1, 2), etag="v3", lease_owner="me")
+    assert registry.put_claimed(claimed).etag == "v3"  # another process has worked it since
+
+    assert registry.merge(make_worker("a" * 24, "w1", started=True, etag="v0"), ["started"]).etag == "v3"
+    assert registry.get("a" * 24).started
@@ -0,0 +1,188 @@
+import logging
+from types import SimpleNamespace
+
+from bson import ObjectId
+from pymongo.errors import AutoReconnect, BulkWriteError, DocumentTooLarge, ServerSelectionTimeoutError
+
+from app.core.write_buffer import DUPLICATE_KEY_ERROR, WriteBuffer
+
+
+class FakeCollection:
+    """Keeps the documents in a dict, `fail` makes the next call fail: a set of the indexes of the failing
+    writes, or an exception raised after the writes are applied. A document with a "too_large" key is rejected
+    as pymongo does it, the documents before it are inserted already."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.docs = {}
+        self.fail = None
+
+    def insert_many(self, docs, ordered):
+        fail, self.fail = self.fail, None
+        errors = []
+        for i, doc in enumerate(docs):
+            doc.setdefault("_id", ObjectId())
+            if "too_large" in doc:
+                raise DocumentTooLarge("BSON document too large")
+            if doc["_id"] in self.docs:
+                errors.append({"index": i, "code": DUPLICATE_KEY_ERROR, "errmsg": "duplicate key"})
+            elif isinstance(fail, set) and i in fail:
+                errors.append({"index": i, "code": 10107, "errmsg": "not primary"})
+            else:
+                self.docs[doc["_id"]] = dict(doc)
+        self._raise(fail, errors)
+
+    def bulk_write(self, requests, ordered):
+        fail, self.fail = self.fail, None
+        errors = []
+        for i, request in enumerate(requests):
+            if isinstance(fail, set) and i in fail:
+                errors.append({"index": i, "code": 10107, "errmsg": "not primary"})
+                continue
+            doc = self.docs[request._filter["_id"]]
+            doc.update(request._doc.get("$set", {}))
+            for field, value in request._doc.get("$inc", {}).items():
+                doc[field] = doc.get(field, 0) + value
+        self._raise(fail, errors)
+
+    @staticmethod
+    def _raise(fail, errors):
+        if isinstance(fail, Exception):
+            raise fail
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "writeConcernErrors": []})
+
+
+class FakeModel:
+    def __init__(self, **doc):
+        self.doc = doc
+
+    def to_doc(self):
+        return dict(self.doc)
+
+
+def make_buffer(limit: int = 100):
+    data, worker = FakeCollection("data"), FakeCollection("worker")
+    buffer = WriteBuffer(logging.getLogger("test"), flush_size=100, flush_interval=1, limit=limit)
+    return buffer, SimpleNamespace(collection=data), SimpleNamespace(collection=worker)
+
+
+def test_insert_retry_after_unknown_outcome():
+    buffer, data, _ = make_buffer()
+    for i in range(3):
+        buffer.insert_one(data, FakeModel(n=i))
+    data.collection.fail = AutoReconnect("connection closed")  # the docs are inserted, but the reply is lost
+    buffer.flush()
+    assert buffer.get_stats()["pending"] == 3
+
+    buffer.flush()  # the same _ids again: duplicate key errors, which count as written
+    assert buffer.get_stats()["pending"] == 0
+    assert sorted(d["n"] for d in data.collection.docs.values()) == [0, 1, 2]
+
+
+def test_insert_partial_failure():
+    buffer, data, worker = make_buffer()
+    pk = ObjectId()
+    worker.collection.docs[pk] = {"_id": pk, "data_count": 0}
+    for i in range(3):
+        buffer.insert_one(data, FakeModel(n=i))
+    buffer.update_by_id(worker, str(pk), {"$inc": {"data_count": 3}})
+    data.collection.fail = {1}
+    buffer.flush()
+    assert len(data.collection.docs) == 2
+    assert worker.collection.docs[pk]["data_count"] == 0  # the updates wait for the failed insert
+    assert buffer.get_stats()["pending"] == 2
+
+    buffer.flush()
+    assert sorted(d["n"] for d in data.collection.docs.values()) == [0, 1, 2]
+    assert worker.collection.docs[pk]["data_count"] == 3
+
+
+def test_invalid_document_is_dropped():
+    buffer, data, worker = make_buffer()
+    pk = ObjectId()
+    worker.collection.docs[pk] = {"_id": pk, "data_count": 0}
+    for i in range(5):
+        buffer.insert_one(data, FakeModel(n=i, too_large=True) if i == 3 else FakeModel(n=i))
+    buffer.update_by_id(worker, str(pk), {"$inc": {"data_count": 5}})
+    buffer.flush()
+    stats = buffer.get_stats()
+    assert stats["pending"] == 0 and stats["dropped"] == 1 and stats["written"] == 5
+    assert sorted(d["n"] for d in data.collection.docs.values()) == [0, 1, 2, 4]
+    assert worker.collection.docs[pk]["data_count"] == 5  # the updates are not held back by the dropped insert
+
+
+def test_permanent_write_error_is_dropped():
+    buffer, data, _ = make_buffer()
+    for i in range(3):
+        buffer.insert_one(data, FakeModel(n=i))
+    data.collection.fail = {1}
+    data.collection.insert_many = _failing(data.collection.insert_many, code=121)  # document failed validation
+    buffer.flush()
+    stats = buffer.get_stats()
+    assert stats["pending"] == 0 and stats["dropped"] == 1 and stats["written"] == 2
+
+
+def test_update_partial_failure():
+    buffer, _, worker = make_buffer()
+    pks = [ObjectId() for _ in range(3)]
+    for pk in pks:
+        worker.collection.docs[pk] = {"_id": pk, "data_count": 0}
+        buffer.update_by_id(worker, str(pk), {"$set": {"failures": 0}, "$inc": {"data_count": 1}})
+    worker.collection.fail = {1}
+    buffer.flush()
+    assert buffer.get_stats()["pending"] == 1  # only the failed update is requeued
+
+    buffer.flush()
+    assert [worker.collection.docs[pk]["data_count"] for pk in pks] == [1, 1, 1]
+
+
+def test_update_unknown_outcome_is_retried_without_inc():
+    buffer, _, worker = make_buffer()
+    pk = ObjectId()
+    worker.collection.docs[pk] = {"_id": pk, "data_count": 0}
+    buffer.update_by_id(worker, str(pk), {"$set": {"failures": 2}, "$inc": {"data_count": 1}})
+    buffer.update_by_id(worker, str(pk), {"$inc": {"data_count": 1}})
+    worker.collection.fail = AutoReconnect("connection closed")
+    buffer.flush()
+    assert buffer.get_stats()["pending"] == 1  # the $set part of the first update
+
+    buffer.flush()
+    assert worker.collection.docs[pk] == {"_id": pk, "data_count": 2, "failures": 2}
+
+    buffer.update_by_id(worker, str(pk), {"$inc": {"data_count": 1}})
+    worker.collection.bulk_write = _unavailable  # nothing was sent, it's retried as is
+    buffer.flush()
+    assert buffer.get_stats()["pending"] == 1
+
+
+def test_drop_over_limit():
+    buffer, data, worker = make_buffer(limit=4)
+    data.collection.insert_many = worker.collection.bulk_write = _unavailable
+    buffer.insert_one(data, FakeModel(n=1))
+    buffer.update_by_id(worker, str(ObjectId()), {"$set": {"last_data_id": "1"}})
+    buffer.insert_one(data, FakeModel(n=2))
+    buffer.update_by_id(worker, str(ObjectId()), {"$set": {"last_data_id": "2"}})  # the limit: flush and drop
+    assert buffer.get_stats()["pending"] == 4
+
+    buffer.insert_one(data, FakeModel(n=3))
+    stats = buffer.get_stats()
+    assert stats["pending"] == 4 and stats["dropped"] == 1
+    assert [update for _, update in buffer._updates["worker"]] == [{"$set": {"last_data_id": "2"}}]
+    assert [d["n"] for d in buffer._inserts["data"]] == [1, 2, 3]  # the updates are dropped first
+
+
+def _failing(write, code: int):
+    def call(*args, **kwargs):
+        try:
+            write(*args, **kwargs)
+        except BulkWriteError as e:
+            raise BulkWriteError(
+                {**e.details, "writeErrors": [{**err, "code": code} for err in e.details["writeErrors"]]}
+            )
+
+    return call
+
+
+def _unavailable(*args, **kwargs):
+    raise ServerSelectionTimeoutError("no servers")